@@ -0,0 +1,189 @@
+"""Answer a JSONL file of questions over the Lab 4 syllabus corpus, no browser needed.
+
+    python batch_qa.py questions.jsonl answers.jsonl
+    python batch_qa.py requests.jsonl answers.jsonl --retrieve-only
+
+Each input line is {"question": ...} or, like requests.jsonl, {"title": ...,
+"body": ...}; an "id" / "request_id" field is kept, otherwise the line
+number is used. Output lines are appended as answers finish, so an
+interrupted run picks up where it stopped: ids already answered without
+an error are skipped. Empty answers and answers cut off at
+ANSWER_MAX_TOKENS count as errors. A retried id gets a new line, so the
+output can hold several lines per id: the last one is the result, e.g.
+
+    jq -s 'group_by(.id) | map(last)[]' answers.jsonl
+
+Needs OPENAI_API_KEY in the environment.
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+from chunking import format_source
+from context_packer import pack_context
+from llm import OpenAIChat, run_coroutine
+from rag import PDF_FOLDER, PERSIST_PATH, Lab4Store, build_rag_messages
+
+ANSWER_MODEL = "gpt-5-mini"
+ANSWER_CONCURRENCY = 8
+# gpt-5-mini is a reasoning model, reasoning tokens count against this
+# budget as well, so it has room for both and the effort is kept low
+ANSWER_MAX_TOKENS = 4096
+ANSWER_REASONING_EFFORT = "low"
+# questions embedded + queried together, also the unit of progress
+BATCH_SIZE = 256
+N_RESULTS = 8
+
+
+def read_questions(path):
+    with open(path, encoding="utf-8") as f:
+        for line_number, line in enumerate(f, start=1):
+            if not line.strip():
+                continue
+            row = json.loads(line)
+            question = row.get("question")
+            if not question:
+                question = "\n\n".join(filter(None, [row.get("title"), row.get("body")]))
+            if not question:
+                continue
+            question_id = row.get("id") or row.get("request_id") or str(line_number)
+            yield str(question_id), question
+
+
+def read_done(path):
+    done = set()
+    if not os.path.exists(path):
+        return done
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                row = json.loads(line)
+            except ValueError:
+                # half-written last line from an interrupted run
+                continue
+            if not row.get("error"):
+                done.add(row["id"])
+    return done
+
+
+def _batches(items, size):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+async def _answer_batch(chat, prepared, concurrency, write):
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def answer(item):
+        async with semaphore:
+            started = time.perf_counter()
+            usage = {}
+            try:
+                item["answer"] = await chat.acomplete(
+                    item.pop("messages"), max_tokens=ANSWER_MAX_TOKENS, usage=usage
+                )
+            except Exception as e:
+                item["error"] = f"{type(e).__name__}: {e}"
+            else:
+                # not errors for the api, but not answers either: retried on resume
+                if usage.get("finish_reason") == "length":
+                    item["error"] = f"answer cut off at {ANSWER_MAX_TOKENS} tokens"
+                elif not item["answer"].strip():
+                    item["error"] = "empty answer"
+            item["timings"]["answer_ms"] = round(1000 * (time.perf_counter() - started), 1)
+            return item
+
+    # written in completion order, as soon as each answer is back
+    for next_done in asyncio.as_completed([answer(item) for item in prepared]):
+        write(await next_done)
+
+
+def run(args):
+    done = read_done(args.output)
+    questions = [(qid, q) for qid, q in read_questions(args.input) if qid not in done]
+    if args.limit:
+        questions = questions[:args.limit]
+    print(f"{len(questions)} questions to answer ({len(done)} already done)", file=sys.stderr)
+    if not questions:
+        return
+
+    started = time.perf_counter()
+    store = Lab4Store(pdf_folder=args.pdf_folder, persist_path=args.persist_path)
+    print(f"index sync: {store.refresh()} in {time.perf_counter() - started:.1f}s", file=sys.stderr)
+
+    chat = None
+    if not args.retrieve_only:
+        chat = OpenAIChat(
+            os.environ["OPENAI_API_KEY"], args.model, reasoning_effort=args.reasoning_effort
+        )
+    answered = 0
+
+    with open(args.output, "a+", encoding="utf-8") as out:
+        # finish a line cut off by an interrupted run before appending
+        if out.tell():
+            out.seek(out.tell() - 1)
+            if out.read(1) != "\n":
+                out.write("\n")
+
+        def write(item):
+            nonlocal answered
+            out.write(json.dumps(item, ensure_ascii=False) + "\n")
+            out.flush()
+            answered += 1
+
+        for batch in _batches(questions, args.batch_size):
+            # one embedding call + one multi-vector chroma query per batch
+            batch_started = time.perf_counter()
+            all_hits = store.search_many([q for _, q in batch], n_results=args.n_results)
+            retrieve_ms = 1000 * (time.perf_counter() - batch_started) / len(batch)
+
+            prepared = []
+            for (qid, question), hits in zip(batch, all_hits):
+                pack_started = time.perf_counter()
+                context, sources = pack_context(question, hits, store.embedding_function)
+                prepared.append({
+                    "id": qid,
+                    "question": question,
+                    # sources = passages packed into the prompt, retrieved = all hits
+                    "sources": sources,
+                    "retrieved": [format_source(hit["metadata"]) for hit in hits],
+                    "messages": build_rag_messages(context, question),
+                    "timings": {
+                        "retrieve_ms": round(retrieve_ms, 1),
+                        "pack_ms": round(1000 * (time.perf_counter() - pack_started), 1),
+                    },
+                })
+
+            if chat is None:
+                for item in prepared:
+                    del item["messages"]
+                    write(item)
+            else:
+                run_coroutine(_answer_batch(chat, prepared, args.concurrency, write))
+
+            elapsed = time.perf_counter() - started
+            print(f"{answered}/{len(questions)} done, {answered / elapsed:.1f} questions/s", file=sys.stderr)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Batch Q&A over the Lab 4 syllabus corpus.")
+    parser.add_argument("input", help="jsonl file of questions")
+    parser.add_argument("output", help="jsonl file to append answers to")
+    parser.add_argument("--model", default=ANSWER_MODEL)
+    parser.add_argument("--reasoning-effort", default=ANSWER_REASONING_EFFORT,
+                        help="reasoning effort for the answer model, empty for the model default")
+    parser.add_argument("--concurrency", type=int, default=ANSWER_CONCURRENCY)
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--n-results", type=int, default=N_RESULTS)
+    parser.add_argument("--limit", type=int, help="answer at most this many questions")
+    parser.add_argument("--retrieve-only", action="store_true", help="write sources, skip the llm")
+    parser.add_argument("--pdf-folder", default=PDF_FOLDER)
+    parser.add_argument("--persist-path", default=PERSIST_PATH)
+    run(parser.parse_args(argv))
+
+
+if __name__ == "__main__":
+    main()
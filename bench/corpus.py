@@ -0,0 +1,91 @@
+import os
+import random
+
+# synthetic pdf corpus for the benchmarks: paragraphs sampled from the
+# real syllabi in lab4_pdfs, shuffled and lightly mutated, laid out into
+# new pdfs. same seed -> same corpus
+SOURCE_FOLDER = "lab4_pdfs"
+PAGES_PER_DOC = (3, 12)
+PARAGRAPHS_PER_PAGE = (4, 9)
+
+
+def source_paragraphs(folder=SOURCE_FOLDER):
+    import fitz  # PyMuPDF
+
+    paragraphs = []
+    for name in sorted(os.listdir(folder)):
+        if not name.lower().endswith(".pdf"):
+            continue
+        with fitz.open(os.path.join(folder, name)) as doc:
+            for page in doc:
+                for block in page.get_text("blocks"):
+                    text = " ".join(block[4].split())
+                    if len(text) > 40:
+                        paragraphs.append(text)
+    return paragraphs
+
+
+def _mutate(paragraph, rng, vocabulary):
+    # swap a few words so documents don't deduplicate to the sources
+    words = paragraph.split()
+    for _ in range(max(1, len(words) // 15)):
+        words[rng.randrange(len(words))] = rng.choice(vocabulary)
+    return " ".join(words)
+
+
+def generate_corpus(out_dir, n_docs, seed=0, source_folder=SOURCE_FOLDER):
+    """Write n_docs synthetic pdfs to out_dir, return their paths.
+
+    Existing files with the same names are kept, so a larger corpus can
+    be grown from a smaller one.
+    """
+    import fitz  # PyMuPDF
+
+    paragraphs = source_paragraphs(source_folder)
+    if not paragraphs:
+        raise ValueError(f"no text found in {source_folder}")
+    vocabulary = sorted({word for p in paragraphs for word in p.split() if word.isalpha()})
+
+    os.makedirs(out_dir, exist_ok=True)
+    paths = []
+    for i in range(n_docs):
+        path = os.path.join(out_dir, f"synthetic_{i:05d}.pdf")
+        paths.append(path)
+        if os.path.exists(path):
+            continue
+
+        rng = random.Random(f"{seed}-{i}")
+        doc = fitz.open()
+        for _ in range(rng.randint(*PAGES_PER_DOC)):
+            page = doc.new_page()
+            text = "\n\n".join(
+                _mutate(rng.choice(paragraphs), rng, vocabulary)
+                for _ in range(rng.randint(*PARAGRAPHS_PER_PAGE))
+            )
+            page.insert_textbox(page.rect + (54, 54, -54, -54), text, fontsize=9)
+        doc.save(path, garbage=3, deflate=True)
+        doc.close()
+    return paths
+
+
+def sample_questions(n, seed=0, source_folder=SOURCE_FOLDER, words=8):
+    """Short questions made of spans of source text, for retrieval runs."""
+    rng = random.Random(f"questions-{seed}")
+    paragraphs = source_paragraphs(source_folder)
+    questions = []
+    for _ in range(n):
+        tokens = rng.choice(paragraphs).split()
+        start = rng.randrange(max(1, len(tokens) - words))
+        questions.append("What does the syllabus say about " + " ".join(tokens[start:start + words]) + "?")
+    return questions
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Generate a synthetic pdf corpus.")
+    parser.add_argument("out_dir")
+    parser.add_argument("--docs", type=int, default=100)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    print(f"{len(generate_corpus(args.out_dir, args.docs, seed=args.seed))} pdfs in {args.out_dir}")
@@ -0,0 +1,355 @@
+"""Offline benchmarks for the lab pages.
+
+    python -m bench.run --docs 200 --out bench_results.json
+    python -m bench.run --baseline bench_results.json   # flag regressions
+
+Everything runs against bench.stub_server (no keys, no network) in a
+scratch directory, so the pdf/embedding/summary caches start cold.
+tiktoken still needs its cl100k_base file, set TIKTOKEN_CACHE_DIR on
+machines without internet access.
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if REPO_ROOT not in sys.path:
+    sys.path.insert(0, REPO_ROOT)
+
+from bench.corpus import generate_corpus, sample_questions  # noqa: E402
+from bench.startup import first_paint, import_times  # noqa: E402
+from bench.stub_server import StubServer  # noqa: E402
+
+# a metric regressed when it is this much worse than the baseline
+REGRESSION_TOLERANCE = 0.20
+
+
+def _percentiles(samples):
+    samples = sorted(samples)
+    if not samples:
+        return {}
+
+    def pick(q):
+        return samples[min(len(samples) - 1, max(0, int(round(q * len(samples))) - 1))]
+
+    return {
+        "n": len(samples),
+        "mean_ms": 1000 * statistics.fmean(samples),
+        "p50_ms": 1000 * pick(0.50),
+        "p99_ms": 1000 * pick(0.99),
+        "max_ms": 1000 * samples[-1],
+    }
+
+
+class StubEmbeddings:
+    """OpenAI embeddings through the pooled sdk client (pointed at the stub)."""
+
+    def __init__(self, api_key, model):
+        from llm import get_openai_client
+
+        self.client = get_openai_client(api_key)
+        self.model = model
+
+    def __call__(self, input):
+        response = self.client.embeddings.create(model=self.model, input=list(input))
+        return [item.embedding for item in response.data]
+
+
+def bench_extraction(paths):
+    import pdf_utils
+
+    def run():
+        started = time.perf_counter()
+        pages = sum(len(p) for _, p in pdf_utils.extract_pdf_files(paths))
+        return pages, time.perf_counter() - started
+
+    pages, cold_s = run()
+    pdf_utils._memory_cache.clear()
+    _, disk_s = run()
+    _, memory_s = run()
+
+    size_mb = sum(os.path.getsize(p) for p in paths) / 1e6
+    return {
+        "docs": len(paths),
+        "pages": pages,
+        "megabytes": round(size_mb, 2),
+        "cold_s": cold_s,
+        "cold_pages_per_s": pages / cold_s,
+        "cold_mb_per_s": size_mb / cold_s,
+        "disk_cache_s": disk_s,
+        "memory_cache_s": memory_s,
+    }
+
+
+def bench_ingestion(corpus_dir, embedder, persist_path):
+    import rag
+
+    started = time.perf_counter()
+    collection = rag.create_lab4_vectordb(corpus_dir, embedding_function=embedder, persist_path=persist_path)
+    ingest_s = time.perf_counter() - started
+    chunks = collection.count()
+
+    # second run finds every file unchanged in the manifest
+    started = time.perf_counter()
+    rag.create_lab4_vectordb(corpus_dir, embedding_function=embedder, persist_path=persist_path)
+    resync_s = time.perf_counter() - started
+
+    return {
+        "chunks": chunks,
+        "ingest_s": ingest_s,
+        "chunks_per_s": chunks / ingest_s,
+        "noop_resync_s": resync_s,
+    }
+
+
+def bench_retrieval(corpus_dir, embedder, persist_path, questions):
+    import rag
+
+    store = rag.Lab4Store(pdf_folder=corpus_dir, persist_path=persist_path, embedding_function=embedder)
+    store.refresh()
+
+    def run():
+        samples = []
+        for question in questions:
+            started = time.perf_counter()
+            rag.retrieve_top_docs(question, n_results=3, store=store)
+            samples.append(time.perf_counter() - started)
+        return samples
+
+    cold = run()  # retrieval cache empty, query embeddings not cached
+    warm = run()  # every question repeats
+    return {"cold": _percentiles(cold), "warm": _percentiles(warm), "store": store}
+
+
+def bench_conversation_buffer(lengths=(100, 1_000, 10_000), repeat=200):
+    from chat_memory import ConversationMemory, conversation_buffer
+
+    results = {}
+    for length in lengths:
+        messages = [{"role": "system", "content": "You are a helpful assistant."}]
+        for i in range(length // 2):
+            messages.append({"role": "user", "content": f"question {i} " * 20})
+            messages.append({"role": "assistant", "content": f"answer {i} " * 60})
+
+        started = time.perf_counter()
+        for _ in range(repeat):
+            conversation_buffer(messages)
+        buffer_s = (time.perf_counter() - started) / repeat
+
+        memory = ConversationMemory("You are a helpful assistant.")
+        started = time.perf_counter()
+        for message in messages[1:]:
+            memory.append(message["role"], message["content"])
+        append_s = (time.perf_counter() - started) / max(1, len(messages) - 1)
+
+        results[str(length)] = {
+            "conversation_buffer_us": 1e6 * buffer_s,
+            "memory_append_us": 1e6 * append_s,
+        }
+    return results
+
+
+def bench_llm(questions, store, embedder, runs):
+    from context_packer import pack_context
+    from llm import OpenAIChat
+
+    chat = OpenAIChat("bench", "gpt-5-mini")
+
+    ttft, total = [], []
+    for _ in range(runs):
+        usage = {}
+        for _ in chat.stream([{"role": "user", "content": "Say hello."}], usage=usage):
+            pass
+        ttft.append(usage["ttft_s"])
+        total.append(usage["total_s"])
+
+    # question in -> first token out, the lab 4 rag path
+    end_to_end = []
+    for question in questions[:runs]:
+        started = time.perf_counter()
+        hits = store.search(question, n_results=8)
+        context, _ = pack_context(question, hits, embedder)
+        stream = chat.stream([
+            {"role": "system", "content": "Answer from the course materials."},
+            {"role": "user", "content": f"CONTEXT:\n{context}\n\nQUESTION: {question}"},
+        ])
+        next(stream)
+        end_to_end.append(time.perf_counter() - started)
+        stream.close()
+
+    return {
+        "ttft": _percentiles(ttft),
+        "stream_total": _percentiles(total),
+        "rag_end_to_end_ttft": _percentiles(end_to_end),
+    }
+
+
+def bench_weather(base_url, locations):
+    from weather import WeatherClient
+
+    client = WeatherClient("bench", base_url=base_url, rate_limit_per_minute=1_000_000)
+
+    def run():
+        samples = []
+        for location in locations:
+            started = time.perf_counter()
+            client.get(location)
+            samples.append(time.perf_counter() - started)
+        return samples
+
+    return {"cold": _percentiles(run()), "cached": _percentiles(run())}
+
+
+def _git_commit():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "HEAD"], cwd=REPO_ROOT, stderr=subprocess.DEVNULL, text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _flatten(results, prefix=""):
+    for key, value in results.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            yield from _flatten(value, name + ".")
+        elif isinstance(value, (int, float)):
+            yield name, value
+
+
+def compare(results, baseline, tolerance=REGRESSION_TOLERANCE):
+    """Return [(metric, baseline, current)] for timings that got slower."""
+    old = dict(_flatten(baseline["results"]))
+    regressions = []
+    for name, value in _flatten(results["results"]):
+        # only latencies/durations, where lower is better
+        if not name.endswith(("_s", "_ms", "_us")) or name not in old:
+            continue
+        if old[name] > 0 and value > old[name] * (1 + tolerance):
+            regressions.append((name, old[name], value))
+    return regressions
+
+
+def run(args):
+    corpus_dir = os.path.abspath(args.corpus or os.path.join(args.workdir, "corpus"))
+    source_folder = os.path.join(REPO_ROOT, "lab4_pdfs")
+    paths = generate_corpus(corpus_dir, args.docs, seed=args.seed, source_folder=source_folder)
+    questions = sample_questions(args.queries, seed=args.seed, source_folder=source_folder)
+
+    # caches are relative to the working directory
+    os.chdir(args.workdir)
+
+    stub = StubServer(
+        chat_latency_s=args.chat_latency,
+        tokens_per_s=args.tokens_per_s,
+        embedding_latency_s=args.embedding_latency,
+    ).start()
+    os.environ["OPENAI_BASE_URL"] = stub.openai_base_url
+    os.environ["OPENAI_API_KEY"] = "bench"
+
+    import rag
+    from embed_cache import CachedEmbeddingFunction
+
+    embedder = CachedEmbeddingFunction(StubEmbeddings("bench", rag.EMBEDDING_MODEL), rag.EMBEDDING_MODEL)
+    persist_path = os.path.join(args.workdir, "chroma")
+
+    results = {}
+    try:
+        if not args.skip_startup:
+            print("startup...", file=sys.stderr)
+            paint_dir = os.path.join(args.workdir, "first_paint")
+            os.makedirs(paint_dir, exist_ok=True)
+            results["startup"] = {
+                "imports": import_times(),
+                "pages": first_paint(
+                    paint_dir,
+                    env={"OPENAI_BASE_URL": stub.openai_base_url, "OPENWEATHER_BASE_URL": stub.base_url},
+                ),
+            }
+        print("extraction...", file=sys.stderr)
+        results["extraction"] = bench_extraction(paths)
+        print("ingestion...", file=sys.stderr)
+        results["ingestion"] = bench_ingestion(corpus_dir, embedder, persist_path)
+        print("retrieval...", file=sys.stderr)
+        retrieval = bench_retrieval(corpus_dir, embedder, persist_path, questions)
+        store = retrieval.pop("store")
+        results["retrieval"] = retrieval
+        print("conversation buffer...", file=sys.stderr)
+        results["conversation_buffer"] = bench_conversation_buffer()
+        print("llm...", file=sys.stderr)
+        results["llm"] = bench_llm(questions, store, embedder, args.llm_runs)
+        print("weather...", file=sys.stderr)
+        results["weather"] = bench_weather(stub.base_url, [f"City {i}, US" for i in range(args.queries)])
+    finally:
+        stub.stop()
+
+    return {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "commit": _git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "settings": {
+                "docs": args.docs,
+                "queries": args.queries,
+                "llm_runs": args.llm_runs,
+                "seed": args.seed,
+                "chat_latency_s": args.chat_latency,
+                "tokens_per_s": args.tokens_per_s,
+                "embedding_latency_s": args.embedding_latency,
+            },
+            "stub_requests": stub.requests,
+        },
+        "results": results,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Offline benchmarks for the lab pages.")
+    parser.add_argument("--docs", type=int, default=50, help="synthetic pdfs to generate")
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--llm-runs", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--chat-latency", type=float, default=0.25)
+    parser.add_argument("--tokens-per-s", type=float, default=200.0)
+    parser.add_argument("--embedding-latency", type=float, default=0.05)
+    parser.add_argument("--skip-startup", action="store_true", help="skip import/first-paint timings")
+    parser.add_argument("--corpus", help="reuse/grow a corpus directory between runs")
+    parser.add_argument("--workdir", help="scratch directory (default: a new temp dir)")
+    parser.add_argument("--out", help="write results json here (default: stdout)")
+    parser.add_argument("--baseline", help="results json to compare against")
+    args = parser.parse_args(argv)
+
+    args.workdir = os.path.abspath(args.workdir or tempfile.mkdtemp(prefix="lab-bench-"))
+    os.makedirs(args.workdir, exist_ok=True)
+    out = os.path.abspath(args.out) if args.out else None
+    baseline = os.path.abspath(args.baseline) if args.baseline else None
+
+    results = run(args)
+
+    text = json.dumps(results, indent=2)
+    if out:
+        with open(out, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+    if baseline:
+        with open(baseline, encoding="utf-8") as f:
+            regressions = compare(results, json.load(f))
+        for name, old, new in regressions:
+            print(f"REGRESSION {name}: {old:.4g} -> {new:.4g}", file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,85 @@
+import json
+import os
+import subprocess
+import sys
+
+# cold-start numbers, each measured in a fresh interpreter: import time of
+# the app modules and heavy dependencies, and time to first paint of each
+# page (first script run through streamlit's AppTest, imports included)
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+IMPORT_MODULES = (
+    "streamlit", "fitz", "chromadb", "openai", "anthropic", "tiktoken",
+    "llm", "pdf_utils", "rag", "chunking", "summarize", "chat_memory", "weather", "tools",
+)
+PAGES = ("lab1.py", "lab2.py", "lab3.py", "lab4.py", "lab5.py")
+
+_IMPORT_SNIPPET = """
+import importlib, json, time, warnings
+warnings.simplefilter("ignore")
+started = time.perf_counter()
+try:
+    importlib.import_module({module!r})
+    print(json.dumps({{"seconds": time.perf_counter() - started}}))
+except ImportError as e:
+    print(json.dumps({{"error": str(e)}}))
+"""
+
+_PAINT_SNIPPET = """
+import json, time
+started = time.perf_counter()
+try:
+    from streamlit.testing.v1 import AppTest
+except ImportError as e:
+    print(json.dumps({{"error": str(e)}}))
+    raise SystemExit
+at = AppTest.from_file({path!r}, default_timeout=120)
+for name in ("OPENAI_API_KEY", "CLAUDE_API_KEY", "OPENWEATHER_API_KEY"):
+    at.secrets[name] = "bench"
+at.run()
+print(json.dumps({{
+    "seconds": time.perf_counter() - started,
+    "exceptions": [str(e.value) for e in at.exception],
+}}))
+"""
+
+
+def _run(code, env=None, cwd=None):
+    env = dict(os.environ, **(env or {}))
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [REPO_ROOT, env.get("PYTHONPATH")]))
+    output = subprocess.run(
+        [sys.executable, "-c", code],
+        capture_output=True, text=True, env=env, cwd=cwd or REPO_ROOT, timeout=600,
+    )
+    lines = output.stdout.strip().splitlines()
+    if output.returncode != 0 or not lines:
+        return {"error": (output.stderr.strip().splitlines() or ["failed"])[-1]}
+    return json.loads(lines[-1])
+
+
+def import_times(modules=IMPORT_MODULES, repeat=3):
+    """Best of `repeat` cold imports per module, in ms (None if not installed)."""
+    results = {}
+    for module in modules:
+        runs = [_run(_IMPORT_SNIPPET.format(module=module)) for _ in range(repeat)]
+        ok = [r["seconds"] for r in runs if "seconds" in r]
+        results[module] = {"import_ms": 1000 * min(ok)} if ok else {"error": runs[-1]["error"]}
+    return results
+
+
+def first_paint(workdir, env=None, pages=PAGES):
+    """First script run of each page in a fresh process, in ms.
+
+    Runs in workdir (with lab4_pdfs linked in) so caches and the chroma
+    store written by the lab 4 warm-up don't touch the repo.
+    """
+    link = os.path.join(workdir, "lab4_pdfs")
+    if not os.path.exists(link):
+        os.symlink(os.path.join(REPO_ROOT, "lab4_pdfs"), link)
+
+    results = {}
+    for page in pages:
+        result = _run(_PAINT_SNIPPET.format(path=os.path.join(REPO_ROOT, page)), env=env, cwd=workdir)
+        if "seconds" in result:
+            result["first_paint_ms"] = 1000 * result.pop("seconds")
+        results[page] = result
+    return results
@@ -0,0 +1,256 @@
+import base64
+import hashlib
+import json
+import math
+import threading
+import time
+from array import array
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+# local stand-ins for the OpenAI chat/embeddings endpoints and
+# OpenWeatherMap, so the benchmarks run without network access or keys.
+# point the sdk at it with OPENAI_BASE_URL=http://127.0.0.1:<port>/v1 and
+# the weather client with OPENWEATHER_BASE_URL=http://127.0.0.1:<port>
+DEFAULTS = {
+    "chat_latency_s": 0.25,      # time to first token
+    "tokens_per_s": 200.0,       # streaming rate after the first token
+    "completion_tokens": 120,
+    "embedding_latency_s": 0.05,
+    "embedding_dim": 256,
+    "weather_latency_s": 0.08,
+}
+
+
+def _embed(text, dim):
+    # hashed bag of words, normalized: similar texts get similar vectors
+    vector = [0.0] * dim
+    for word in text.lower().split():
+        digest = hashlib.blake2b(word.encode("utf-8"), digest_size=8).digest()
+        bucket = int.from_bytes(digest[:4], "little") % dim
+        vector[bucket] += 1.0 if digest[4] & 1 else -1.0
+    norm = math.sqrt(sum(v * v for v in vector)) or 1.0
+    return [v / norm for v in vector]
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    @property
+    def config(self):
+        return self.server.config
+
+    def _count(self, name):
+        with self.server.lock:
+            self.server.requests[name] = self.server.requests.get(name, 0) + 1
+
+    def _send_json(self, payload, status=200):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _read_json(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def do_POST(self):
+        path = urlparse(self.path).path
+        if path.endswith("/chat/completions"):
+            self._count("chat")
+            self._chat(self._read_json())
+        elif path.endswith("/embeddings"):
+            self._count("embeddings")
+            self._embeddings(self._read_json())
+        else:
+            self._send_json({"error": {"message": f"unknown path {path}"}}, status=404)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path.endswith("/data/2.5/weather"):
+            self._count("weather")
+            self._weather(parse_qs(url.query))
+        else:
+            self._send_json({"message": "not found"}, status=404)
+
+    def _chat(self, body):
+        config = self.config
+        model = body.get("model", "stub")
+        n_tokens = config["completion_tokens"]
+        prompt_tokens = sum(len(str(m.get("content", "")).split()) for m in body.get("messages", []))
+        usage = {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": n_tokens,
+            "total_tokens": prompt_tokens + n_tokens,
+            "prompt_tokens_details": {"cached_tokens": 0},
+        }
+
+        time.sleep(config["chat_latency_s"])
+
+        if not body.get("stream"):
+            self._send_json({
+                "id": "chatcmpl-stub",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": " ".join(["word"] * n_tokens)},
+                    "finish_reason": "stop",
+                }],
+                "usage": usage,
+            })
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        def send(payload):
+            data = f"data: {payload}\n\n".encode("utf-8")
+            self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+            self.wfile.flush()
+
+        def chunk(delta, finish_reason=None):
+            return json.dumps({
+                "id": "chatcmpl-stub",
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+            })
+
+        interval = 1.0 / config["tokens_per_s"]
+        try:
+            send(chunk({"role": "assistant", "content": ""}))
+            for i in range(n_tokens):
+                if i:
+                    time.sleep(interval)
+                send(chunk({"content": "word "}))
+            send(chunk({}, finish_reason="stop"))
+
+            if (body.get("stream_options") or {}).get("include_usage"):
+                send(json.dumps({
+                    "id": "chatcmpl-stub",
+                    "object": "chat.completion.chunk",
+                    "created": int(time.time()),
+                    "model": model,
+                    "choices": [],
+                    "usage": usage,
+                }))
+            send("[DONE]")
+            self.wfile.write(b"0\r\n\r\n")
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            # the client stopped reading (e.g. after the first token)
+            self.close_connection = True
+
+    def _embeddings(self, body):
+        config = self.config
+        inputs = body.get("input", [])
+        if isinstance(inputs, str):
+            inputs = [inputs]
+
+        time.sleep(config["embedding_latency_s"])
+
+        data = []
+        for i, text in enumerate(inputs):
+            vector = _embed(str(text), config["embedding_dim"])
+            if body.get("encoding_format") == "base64":
+                vector = base64.b64encode(array("f", vector).tobytes()).decode("ascii")
+            data.append({"object": "embedding", "index": i, "embedding": vector})
+
+        tokens = sum(len(str(text).split()) for text in inputs)
+        self._send_json({
+            "object": "list",
+            "data": data,
+            "model": body.get("model", "stub"),
+            "usage": {"prompt_tokens": tokens, "total_tokens": tokens},
+        })
+
+    def _weather(self, query):
+        time.sleep(self.config["weather_latency_s"])
+        location = (query.get("q") or [""])[0]
+        # stable fake numbers per location
+        seed = int.from_bytes(hashlib.sha256(location.lower().encode("utf-8")).digest()[:2], "little")
+        temp = 20 + seed % 70
+        self._send_json({
+            "name": location,
+            "main": {
+                "temp": temp,
+                "feels_like": temp - 2,
+                "temp_min": temp - 5,
+                "temp_max": temp + 5,
+                "humidity": 30 + seed % 60,
+            },
+            "weather": [{"description": ("clear sky", "light rain", "overcast clouds", "snow")[seed % 4]}],
+        })
+
+
+class StubServer:
+    """Threaded stub server on 127.0.0.1, started in a daemon thread.
+
+    with StubServer(chat_latency_s=0.1) as server:
+        os.environ["OPENAI_BASE_URL"] = server.openai_base_url
+    """
+
+    def __init__(self, port=0, **config):
+        unknown = set(config) - set(DEFAULTS)
+        if unknown:
+            raise ValueError(f"unknown stub settings: {sorted(unknown)}")
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", port), _Handler)
+        self.httpd.daemon_threads = True
+        self.httpd.config = dict(DEFAULTS, **config)
+        self.httpd.requests = {}
+        self.httpd.lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self.httpd.server_port}"
+
+    @property
+    def openai_base_url(self):
+        return f"{self.base_url}/v1"
+
+    @property
+    def requests(self):
+        return dict(self.httpd.requests)
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, name="stub-server", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+        return False
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Run the OpenAI/OpenWeather stub server.")
+    parser.add_argument("--port", type=int, default=8765)
+    for name, default in DEFAULTS.items():
+        parser.add_argument(f"--{name.replace('_', '-')}", type=type(default), default=default)
+    args = parser.parse_args()
+
+    config = {name: getattr(args, name) for name in DEFAULTS}
+    server = StubServer(port=args.port, **config)
+    print(f"OPENAI_BASE_URL={server.openai_base_url}")
+    print(f"OPENWEATHER_BASE_URL={server.base_url}")
+    server.httpd.serve_forever()
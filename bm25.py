@@ -0,0 +1,196 @@
+import math
+import os
+import pickle
+import re
+import tempfile
+import threading
+from array import array
+from collections import Counter
+
+# lowercase letters/digits, so "IST 418" -> ["ist", "418"]
+TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+
+def tokenize(text):
+    return TOKEN_RE.findall(text.lower())
+
+
+class BM25Index:
+    """In-memory inverted index with BM25 scoring.
+
+    Postings are compact arrays per term (uint32 document numbers and
+    uint16 term frequencies). search() scores them with numpy straight
+    from those arrays (no copies), so even terms found in most chunks
+    cost a few milliseconds on a few hundred thousand chunks. Removed
+    documents are tombstoned and dropped from the postings by compact().
+    `meta` is a free-form dict saved with the index (rag.Lab4Store keeps
+    the hash of every pdf it covers there).
+    """
+
+    def __init__(self, k1=1.5, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self.doc_ids = []
+        self.doc_numbers = {}
+        self.doc_lengths = array("I")
+        self.postings = {}
+        self.deleted = set()
+        self.total_length = 0
+        self.meta = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.doc_ids) - len(self.deleted)
+
+    def add(self, doc_id, text):
+        terms = Counter(tokenize(text))
+        length = sum(terms.values())
+
+        with self._lock:
+            if doc_id in self.doc_numbers:
+                self._remove(doc_id)
+
+            number = len(self.doc_ids)
+            self.doc_ids.append(doc_id)
+            self.doc_numbers[doc_id] = number
+            self.doc_lengths.append(length)
+            self.total_length += length
+
+            for term, tf in terms.items():
+                posting = self.postings.get(term)
+                if posting is None:
+                    posting = self.postings[term] = (array("I"), array("H"))
+                posting[0].append(number)
+                posting[1].append(min(tf, 65535))
+
+    def remove(self, doc_id):
+        with self._lock:
+            self._remove(doc_id)
+
+    def _remove(self, doc_id):
+        number = self.doc_numbers.pop(doc_id, None)
+        if number is None:
+            return
+        self.deleted.add(number)
+        self.total_length -= self.doc_lengths[number]
+
+    def search(self, query, k=10):
+        """Return up to k (doc_id, score) pairs, best first."""
+        import numpy as np  # only loaded once lab 4 searches
+
+        with self._lock:
+            live = len(self)
+            if not live or k <= 0:
+                return []
+
+            query_terms = [t for t in set(tokenize(query)) if t in self.postings]
+            if not query_terms:
+                return []
+
+            # frombuffer views share memory with the arrays, which can't grow
+            # while a view exists; add() takes the same lock
+            lengths = np.frombuffer(self.doc_lengths, dtype=np.uint32)
+            norm = self.k1 * (1 - self.b + self.b * lengths / (self.total_length / live))
+            scores = np.zeros(len(self.doc_ids))
+            for term in query_terms:
+                numbers, tfs = self.postings[term]
+                df = len(numbers)
+                idf = math.log(1 + (live - df + 0.5) / (df + 0.5))
+                numbers = np.frombuffer(numbers, dtype=np.uint32)
+                tfs = np.frombuffer(tfs, dtype=np.uint16).astype(np.float64)
+                # a term lists each document once, so += can't lose updates
+                scores[numbers] += idf * tfs * (self.k1 + 1) / (tfs + norm[numbers])
+            del lengths, numbers
+
+            if self.deleted:
+                scores[np.fromiter(self.deleted, dtype=np.int64, count=len(self.deleted))] = 0.0
+
+            hits = np.flatnonzero(scores)
+            if len(hits) > k:
+                hits = hits[np.argpartition(scores[hits], -k)[-k:]]
+            hits = hits[np.argsort(-scores[hits], kind="stable")]
+            return [(self.doc_ids[number], float(scores[number])) for number in hits]
+
+    def compact(self):
+        """Rebuild the postings without tombstoned documents."""
+        with self._lock:
+            if not self.deleted:
+                return
+
+            renumber = {}
+            doc_ids = []
+            doc_lengths = array("I")
+            for number, doc_id in enumerate(self.doc_ids):
+                if number in self.deleted:
+                    continue
+                renumber[number] = len(doc_ids)
+                doc_ids.append(doc_id)
+                doc_lengths.append(self.doc_lengths[number])
+
+            postings = {}
+            for term, (numbers, tfs) in self.postings.items():
+                new_numbers, new_tfs = array("I"), array("H")
+                for number, tf in zip(numbers, tfs):
+                    if number in renumber:
+                        new_numbers.append(renumber[number])
+                        new_tfs.append(tf)
+                if new_numbers:
+                    postings[term] = (new_numbers, new_tfs)
+
+            self.doc_ids = doc_ids
+            self.doc_numbers = {doc_id: i for i, doc_id in enumerate(doc_ids)}
+            self.doc_lengths = doc_lengths
+            self.postings = postings
+            self.deleted = set()
+
+    def save(self, path):
+        # compact first when more than a fifth of the documents are tombstones
+        if len(self.deleted) > 0.2 * len(self.doc_ids):
+            self.compact()
+
+        with self._lock:
+            state = {
+                "k1": self.k1,
+                "b": self.b,
+                "doc_ids": self.doc_ids,
+                "doc_lengths": self.doc_lengths,
+                "postings": self.postings,
+                "deleted": self.deleted,
+                "meta": self.meta,
+            }
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or ".", suffix=".tmp")
+            with os.fdopen(fd, "wb") as f:
+                pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "rb") as f:
+            state = pickle.load(f)
+
+        index = cls(k1=state["k1"], b=state["b"])
+        index.doc_ids = state["doc_ids"]
+        index.doc_lengths = state["doc_lengths"]
+        index.postings = state["postings"]
+        index.deleted = state["deleted"]
+        index.meta = state.get("meta", {})
+        index.doc_numbers = {
+            doc_id: i for i, doc_id in enumerate(index.doc_ids) if i not in index.deleted
+        }
+        index.total_length = sum(
+            length for i, length in enumerate(index.doc_lengths) if i not in index.deleted
+        )
+        return index
+
+
+def reciprocal_rank_fusion(rankings, weights=None, k=60):
+    """Fuse ranked id lists into (id, score) pairs, best first.
+
+    score(id) = sum(weight / (k + rank)).
+    """
+    weights = weights or [1.0] * len(rankings)
+    scores = {}
+    for ranking, weight in zip(rankings, weights):
+        for rank, doc_id in enumerate(ranking, start=1):
+            scores[doc_id] = scores.get(doc_id, 0.0) + weight / (k + rank)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
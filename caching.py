@@ -0,0 +1,164 @@
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+# long documents are hashed a slice at a time, so keying them never
+# holds a second, utf-8 encoded copy of the whole text
+HASH_SLICE_CHARS = 1024 * 1024
+
+
+def update_digest(digest, text):
+    """digest.update(text.encode("utf-8")), one slice at a time."""
+    for start in range(0, len(text), HASH_SLICE_CHARS):
+        digest.update(text[start:start + HASH_SLICE_CHARS].encode("utf-8"))
+
+
+# small thread-safe LRU shared by the lab pages
+# bounded by the total "size" of the values (len() by default),
+# entries optionally expire `ttl` seconds after they were stored
+class LRUCache:
+    def __init__(self, max_size, sizeof=len, ttl=None):
+        self.max_size = max_size
+        self.sizeof = sizeof
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and entry[2] is not None and entry[2] < time.monotonic():
+                del self._data[key]
+                self._size -= entry[1]
+                entry = None
+
+            if entry is None:
+                self.misses += 1
+                return default
+
+            self.hits += 1
+            self._data.move_to_end(key)
+            return entry[0]
+
+    def put(self, key, value):
+        size = self.sizeof(value)
+        if size > self.max_size:
+            return
+
+        expires_at = time.monotonic() + self.ttl if self.ttl is not None else None
+
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self._size -= old[1]
+
+            self._data[key] = (value, size, expires_at)
+            self._size += size
+
+            while self._size > self.max_size:
+                _, evicted = self._data.popitem(last=False)
+                self._size -= evicted[1]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._size = 0
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "entries": len(self._data),
+        }
+
+    def __len__(self):
+        return len(self._data)
+
+
+# small sqlite key/value store with least-recently-used eviction,
+# rows are (namespace, key) -> blob
+class SqliteStore:
+    def __init__(self, path, max_entries):
+        self.path = path
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            " namespace TEXT NOT NULL,"
+            " key TEXT NOT NULL,"
+            " value BLOB NOT NULL,"
+            " last_used REAL NOT NULL,"
+            " PRIMARY KEY (namespace, key))"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS entries_last_used ON entries (last_used)"
+        )
+        self._conn.commit()
+        self._count = self._conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+
+    def get_many(self, namespace, keys):
+        found = {}
+        now = time.time()
+        with self._lock:
+            # stay below sqlite's bound-parameter limit
+            for start in range(0, len(keys), 500):
+                part = keys[start:start + 500]
+                placeholders = ",".join("?" * len(part))
+                rows = self._conn.execute(
+                    f"SELECT key, value FROM entries WHERE namespace = ? AND key IN ({placeholders})",
+                    [namespace, *part],
+                ).fetchall()
+                found.update(rows)
+
+            if found:
+                self._conn.executemany(
+                    "UPDATE entries SET last_used = ? WHERE namespace = ? AND key = ?",
+                    [(now, namespace, key) for key in found],
+                )
+                self._conn.commit()
+        return found
+
+    def get(self, namespace, key):
+        return self.get_many(namespace, [key]).get(key)
+
+    def put_many(self, namespace, items):
+        now = time.time()
+        with self._lock:
+            before = self._conn.total_changes
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO entries (namespace, key, value, last_used) VALUES (?, ?, ?, ?)",
+                [(namespace, key, value, now) for key, value in items],
+            )
+            self._count += self._conn.total_changes - before
+            self._conn.commit()
+
+            if self._count > self.max_entries:
+                # drop the oldest ~10% so eviction doesn't run on every put
+                excess = self._count - int(self.max_entries * 0.9)
+                self._conn.execute(
+                    "DELETE FROM entries WHERE rowid IN"
+                    " (SELECT rowid FROM entries ORDER BY last_used LIMIT ?)",
+                    (excess,),
+                )
+                self._conn.commit()
+                self._count -= excess
+
+    def put(self, namespace, key, value):
+        self.put_many(namespace, [(key, value)])
+
+    def __len__(self):
+        return self._count
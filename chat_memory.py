@@ -0,0 +1,245 @@
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from chunking import count_tokens
+
+# lab 3 part b + c - conversational memory
+CHAT_HISTORY_TOKENS = 4000
+# role/formatting tokens the chat format adds around every message
+MESSAGE_OVERHEAD_TOKENS = 4
+
+# rolling summary mode: dropped turns are folded into a summary by a cheap
+# model on a background thread, off the response path
+SUMMARY_MODEL = "gpt-5-nano"
+SUMMARY_PROMPT = (
+    "You maintain a running summary of a conversation between a user and an assistant. "
+    "Update the summary with the new messages. Keep names, numbers, dates, decisions "
+    "and open questions. Reply with the updated summary only, at most 200 words."
+)
+
+# a failed fold is retried after this many seconds, doubled per failure
+SUMMARY_RETRY_SECONDS = 5
+SUMMARY_RETRY_MAX_SECONDS = 300
+
+_summary_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="chat-summary")
+
+
+def conversation_buffer(messages, keep_user_message=2):
+    """List version: system prompt + the last `keep_user_message` user turns.
+
+    Scans from the end and stops as soon as enough user turns are found.
+    """
+    if not messages:
+        return messages
+
+    # keep system prompt
+    system = []
+    if messages[0]["role"] == "system":
+        system = [messages[0]]
+
+    # walk back to the start of the oldest user turn we keep
+    start_index = None
+    seen = 0
+    for i in range(len(messages) - 1, -1, -1):
+        if messages[i]["role"] == "user":
+            seen += 1
+            if seen == keep_user_message:
+                start_index = i
+                break
+
+    # if <= keep_user_message user messages, keep all
+    if start_index is None or not any(
+        messages[i]["role"] == "user" for i in range(start_index)
+    ):
+        return messages
+
+    return system + messages[start_index:]
+
+
+class ConversationMemory:
+    """Chat history trimmed by user turns and by tokens.
+
+    Each message is counted with tiktoken once, when it is appended, and a
+    running total is kept, so trimming only pops whole turns off the front
+    (amortized O(1) per turn). The system prompt is pinned and the latest
+    user turn is always kept.
+    """
+
+    def __init__(self, system_prompt, keep_user_message=2, max_tokens=CHAT_HISTORY_TOKENS):
+        self.system = {"role": "system", "content": system_prompt}
+        self.keep_user_message = keep_user_message
+        self.max_tokens = max_tokens
+        self.system_tokens = count_tokens(system_prompt) + MESSAGE_OVERHEAD_TOKENS
+        self._messages = deque()
+        self.history_tokens = 0
+        self.user_turns = 0
+
+    def append(self, role, content):
+        tokens = count_tokens(content) + MESSAGE_OVERHEAD_TOKENS
+        self._messages.append(({"role": role, "content": content}, tokens))
+        self.history_tokens += tokens
+        if role == "user":
+            self.user_turns += 1
+        self._trim()
+
+    def _pop_front(self):
+        message, tokens = self._messages.popleft()
+        self.history_tokens -= tokens
+        if message["role"] == "user":
+            self.user_turns -= 1
+        return message
+
+    def _trim(self):
+        while self._messages and (
+            self.user_turns > self.keep_user_message
+            or self.system_tokens + self.history_tokens > self.max_tokens
+        ):
+            # never drop the turn that is currently being answered
+            if self.user_turns <= 1 and self._messages[0][0]["role"] == "user":
+                break
+
+            # drop one whole turn: the first message and the replies after it
+            dropped = [self._pop_front()]
+            while self._messages and self._messages[0][0]["role"] != "user":
+                dropped.append(self._pop_front())
+            self.on_trim(dropped)
+
+    def on_trim(self, dropped):
+        # hook for memories that want to keep something from dropped turns
+        pass
+
+    @property
+    def tokens(self):
+        return self.system_tokens + self.history_tokens
+
+    def history(self):
+        return [message for message, _ in self._messages]
+
+    def messages(self):
+        return [self.system] + self.history()
+
+
+def build_chat_messages(memory, document_message):
+    """Messages for one chat turn, laid out for provider prompt caching.
+
+    The system prompt and the document message come first and stay
+    byte-identical from turn to turn; the summary and the trimmed history
+    (the parts that change) follow them.
+    """
+    messages = memory.messages()
+    return [messages[0], document_message] + messages[1:]
+
+
+def make_openai_summarizer(client, model=SUMMARY_MODEL):
+    """Return summarize(summary, messages) -> new summary using `client`."""
+
+    def summarize(summary, messages):
+        transcript = "\n".join(f"{m['role']}: {m['content']}" for m in messages)
+        response = client.chat.completions.create(
+            model=model,
+            messages=[
+                {"role": "system", "content": SUMMARY_PROMPT},
+                {
+                    "role": "user",
+                    "content": f"Current summary:\n{summary or '(empty)'}\n\nNew messages:\n{transcript}",
+                },
+            ],
+        )
+        return response.choices[0].message.content or summary
+
+    return summarize
+
+
+class SummaryMemory(ConversationMemory):
+    """ConversationMemory that folds trimmed turns into a running summary.
+
+    Folding runs on a background thread. Until it finishes, the turns
+    being folded are still sent verbatim, so nothing is lost while the
+    summary catches up. Those turns only get what is left of max_tokens
+    after the history and the summary, oldest dropped first. When the
+    summarizer fails it is retried with a growing delay, and meanwhile
+    turns waiting to be folded are capped at max_tokens as well.
+    """
+
+    def __init__(self, system_prompt, summarize, keep_user_message=2, max_tokens=CHAT_HISTORY_TOKENS):
+        super().__init__(system_prompt, keep_user_message=keep_user_message, max_tokens=max_tokens)
+        self.summarize = summarize
+        self.summary = ""
+        self.summary_tokens = 0
+        # (message, tokens) waiting to be folded / being folded right now
+        self._pending = []
+        self._folding = []
+        self._future = None
+        self._failures = 0
+        self._retry_at = 0.0
+        self._lock = threading.Lock()
+
+    def on_trim(self, dropped):
+        with self._lock:
+            self._pending.extend(
+                (message, count_tokens(message["content"]) + MESSAGE_OVERHEAD_TOKENS)
+                for message in dropped
+            )
+            self._cap_pending()
+        self._poll()
+
+    def _cap_pending(self):
+        # the summarizer is behind (or failing): forget the oldest turns
+        # rather than letting the next fold request grow without bound
+        total = sum(tokens for _, tokens in self._pending)
+        while self._pending and total > self.max_tokens:
+            total -= self._pending.pop(0)[1]
+
+    def _poll(self):
+        with self._lock:
+            if self._future is not None:
+                if not self._future.done():
+                    return
+                try:
+                    self.summary = self._future.result()
+                    self.summary_tokens = count_tokens(self.summary) + MESSAGE_OVERHEAD_TOKENS
+                    self._failures = 0
+                except Exception:
+                    # fold these again later, backing off while it keeps failing
+                    self._pending = self._folding + self._pending
+                    self._cap_pending()
+                    self._failures += 1
+                    self._retry_at = time.monotonic() + min(
+                        SUMMARY_RETRY_MAX_SECONDS,
+                        SUMMARY_RETRY_SECONDS * 2 ** (self._failures - 1),
+                    )
+                self._future = None
+                self._folding = []
+
+            if self._pending and time.monotonic() >= self._retry_at:
+                self._folding, self._pending = self._pending, []
+                self._future = _summary_pool.submit(
+                    self.summarize, self.summary, [message for message, _ in self._folding]
+                )
+
+    def messages(self):
+        self._poll()
+        messages = [self.system]
+        with self._lock:
+            budget = self.max_tokens - self.tokens
+            if self.summary:
+                messages.append({
+                    "role": "system",
+                    "content": f"Summary of the earlier conversation:\n{self.summary}",
+                })
+                budget -= self.summary_tokens
+
+            # newest unsummarized turns that still fit, oldest dropped first
+            verbatim = []
+            for message, tokens in reversed(self._folding + self._pending):
+                if tokens > budget:
+                    break
+                budget -= tokens
+                verbatim.append(message)
+            # start on a user message, not on a reply cut off from its question
+            while verbatim and verbatim[-1]["role"] != "user":
+                verbatim.pop()
+            messages.extend(reversed(verbatim))
+        return messages + self.history()
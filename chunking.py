@@ -0,0 +1,80 @@
+# text-embedding-3-small tokenizes with cl100k_base and accepts up to 8191
+# tokens per input, chunks stay far below that
+ENCODING_NAME = "cl100k_base"
+CHUNK_TOKENS = 400
+CHUNK_OVERLAP_TOKENS = 60
+
+_encoding = None
+
+
+def get_encoding():
+    global _encoding
+    if _encoding is None:
+        import tiktoken
+        _encoding = tiktoken.get_encoding(ENCODING_NAME)
+    return _encoding
+
+
+def count_tokens(text: str) -> int:
+    return len(get_encoding().encode(text, disallowed_special=()))
+
+
+def chunk_pages(pages, source, chunk_tokens=CHUNK_TOKENS, overlap_tokens=CHUNK_OVERLAP_TOKENS):
+    """Split pages into overlapping token windows.
+
+    pages is any iterable of objects with .number and .text, e.g. the Page
+    tuples from pdf_utils.iter_pdf_pages / iter_pdf_files_pages; a
+    streamed pdf is chunked while it is still being parsed. Each chunk is
+    a dict with id, text and metadata (source, page_start, page_end,
+    chunk_index).
+    """
+    if overlap_tokens >= chunk_tokens:
+        raise ValueError("overlap_tokens must be smaller than chunk_tokens")
+
+    encoding = get_encoding()
+    step = chunk_tokens - overlap_tokens
+
+    # tokens waiting to be emitted and the page each of them came from
+    tokens = []
+    token_pages = []
+    chunk_index = 0
+
+    def make_chunk(end):
+        metadata = {
+            "source": source,
+            "page_start": token_pages[0],
+            "page_end": token_pages[end - 1],
+            "chunk_index": chunk_index,
+        }
+        return {
+            "id": f"{source}#{chunk_index}",
+            "text": encoding.decode(tokens[:end]),
+            "tokens": end,
+            "metadata": metadata,
+        }
+
+    for page in pages:
+        page_tokens = encoding.encode(page.text, disallowed_special=())
+        tokens.extend(page_tokens)
+        token_pages.extend([page.number] * len(page_tokens))
+
+        while len(tokens) >= chunk_tokens:
+            yield make_chunk(chunk_tokens)
+            chunk_index += 1
+            del tokens[:step]
+            del token_pages[:step]
+
+    # whatever is left that wasn't already part of the last chunk
+    if len(tokens) > (overlap_tokens if chunk_index else 0):
+        yield make_chunk(len(tokens))
+
+
+def format_source(metadata) -> str:
+    source = metadata["source"]
+    start = metadata.get("page_start")
+    end = metadata.get("page_end")
+    if start is None:
+        return source
+    if start == end:
+        return f"{source} (p. {start})"
+    return f"{source} (pp. {start}-{end})"
@@ -0,0 +1,81 @@
+import math
+
+from chunking import count_tokens, format_source
+
+# lab 4 - build the RAG context from retrieved chunks under a token budget
+CONTEXT_TOKEN_BUDGET = 1500
+# 1.0 = pure relevance, 0.0 = pure diversity
+MMR_LAMBDA = 0.7
+# rank constant of the fusion in rag.py, for hits that carry no score
+RRF_K = 60
+# passages this similar to one already chosen are treated as duplicates
+DUPLICATE_SIMILARITY = 0.95
+SEPARATOR = "\n\n---\n\n"
+
+
+def _cosine(a, b):
+    dot = sum(x * y for x, y in zip(a, b))
+    norm = math.sqrt(sum(x * x for x in a)) * math.sqrt(sum(y * y for y in b))
+    return dot / norm if norm else 0.0
+
+
+def pack_context(question, hits, embedding_function, token_budget=CONTEXT_TOKEN_BUDGET,
+                 mmr_lambda=MMR_LAMBDA):
+    """Pick passages for the prompt with maximal marginal relevance.
+
+    hits are {"id", "text", "metadata", "score"} dicts from Lab4Store.search,
+    best first. Relevance is the fused (dense + bm25) score relative to the
+    best hit, so exact-token matches found by bm25 keep their rank; hits
+    without a score fall back to 1 / (RRF_K + rank). Passages are chosen
+    greedily by relevance minus embedding similarity to what was already
+    chosen, near-duplicates are dropped and selection stops once
+    token_budget is used up. Embeddings come from embedding_function (the
+    cached embedder, so chunk vectors are usually cache hits). The
+    question itself isn't embedded, retrieval already scored the hits.
+    Returns (context, sources).
+    """
+    if not hits:
+        return "", []
+
+    hit_vectors = embedding_function([hit["text"] for hit in hits])
+    scores = [hit.get("score", 1 / (RRF_K + rank)) for rank, hit in enumerate(hits, start=1)]
+    top_score = max(scores) or 1.0
+
+    candidates = []
+    for hit, vector, score in zip(hits, hit_vectors, scores):
+        source = format_source(hit["metadata"])
+        block = f"[Source: {source}]\n{hit['text']}"
+        candidates.append({
+            "block": block,
+            "source": source,
+            "vector": vector,
+            "relevance": score / top_score,
+            "tokens": count_tokens(block) + count_tokens(SEPARATOR),
+        })
+
+    selected = []
+    used_tokens = 0
+    while True:
+        scored = []
+        for candidate in candidates:
+            if used_tokens + candidate["tokens"] > token_budget:
+                continue
+            redundancy = max(
+                (_cosine(candidate["vector"], s["vector"]) for s in selected), default=0.0
+            )
+            if redundancy >= DUPLICATE_SIMILARITY:
+                continue
+            score = mmr_lambda * candidate["relevance"] - (1 - mmr_lambda) * redundancy
+            scored.append((score, candidate))
+
+        if not scored:
+            break
+
+        _, best = max(scored, key=lambda item: item[0])
+        selected.append(best)
+        used_tokens += best["tokens"]
+        candidates.remove(best)
+
+    context = SEPARATOR.join(s["block"] for s in selected)
+    sources = list(dict.fromkeys(s["source"] for s in selected))
+    return context, sources
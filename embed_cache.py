@@ -0,0 +1,75 @@
+import hashlib
+import os
+import threading
+from array import array
+
+from caching import SqliteStore
+from metrics import timed
+
+# embeddings are stored as float32 blobs keyed by (model name, sha256 of text)
+EMBED_CACHE_PATH = os.path.join(".cache", "embeddings.sqlite")
+EMBED_CACHE_MAX_ENTRIES = 500_000
+
+
+def _text_key(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class CachedEmbeddingFunction:
+    """Wrap a chroma-style embedding function with a persistent cache.
+
+    Lookups are done for the whole batch at once and only the misses are
+    sent to the wrapped function (deduplicated). Used for both ingestion
+    and queries, so neither pays twice for the same text.
+    """
+
+    def __init__(self, embedding_function, model_name, path=EMBED_CACHE_PATH,
+                 max_entries=EMBED_CACHE_MAX_ENTRIES):
+        self.embedding_function = embedding_function
+        self.model_name = model_name
+        self.store = SqliteStore(path, max_entries)
+        self.hits = 0
+        self.misses = 0
+        self._stats_lock = threading.Lock()
+
+    def __call__(self, input):
+        texts = list(input)
+        with timed("embed", texts=len(texts)) as fields:
+            keys = [_text_key(t) for t in texts]
+            found = self.store.get_many(self.model_name, keys)
+
+            missing = {}
+            for key, text in zip(keys, texts):
+                if key not in found and key not in missing:
+                    missing[key] = text
+
+            cached = sum(1 for key in keys if key in found)
+            with self._stats_lock:
+                self.hits += cached
+                self.misses += len(texts) - cached
+            fields["misses"] = len(missing)
+
+            if missing:
+                vectors = self.embedding_function(list(missing.values()))
+                new_items = [
+                    (key, array("f", vector).tobytes())
+                    for key, vector in zip(missing, vectors)
+                ]
+                self.store.put_many(self.model_name, new_items)
+                found.update(new_items)
+
+            result = []
+            for key in keys:
+                vector = array("f")
+                vector.frombytes(found[key])
+                result.append(vector.tolist())
+            return result
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "entries": len(self.store),
+        }
@@ -1,5 +1,7 @@
 import streamlit as st
-from openai import OpenAI
+
+from llm import OpenAIChat, text_content
+from uploads import MAX_UPLOAD_MB, UploadTooLarge, read_text
 
 # Show title and description.
 st.title("MY Document question answering")
@@ -16,12 +18,13 @@ if not openai_api_key:
     st.info("Please add your OpenAI API key to continue.", icon="🗝️")
 else:
 
-    # Create an OpenAI client.
-    client = OpenAI(api_key=openai_api_key)
+    # Pooled OpenAI client, reused across reruns while the key is among the
+    # recently used ones (llm.MAX_POOLED_KEYS).
+    chat = OpenAIChat(openai_api_key, "gpt-5-chat-latest")
 
     # Let the user upload a file via `st.file_uploader`.
     uploaded_file = st.file_uploader(
-        "Upload a document (.txt or .md)", type=("txt", "md")
+        "Upload a document (.txt or .md)", type=("txt", "md"), max_upload_size=MAX_UPLOAD_MB
     )
 
     # Ask the user for a question via `st.text_area`.
@@ -33,21 +36,21 @@ else:
 
     if uploaded_file and question:
 
-        # Process the uploaded file and question.
-        document = uploaded_file.read().decode()
+        # Process the uploaded file and question. The text is decoded straight
+        # from the upload buffer and sent as its own content part, so a big
+        # document isn't copied again into one prompt string.
+        try:
+            document = read_text(uploaded_file)
+        except UploadTooLarge as e:
+            st.error(str(e))
+            st.stop()
         messages = [
             {
                 "role": "user",
-                "content": f"Here's a document: {document} \n\n---\n\n {question}",
+                "content": text_content("Here's a document: ", document, f" \n\n---\n\n {question}"),
             }
         ]
 
-        # Generate an answer using the OpenAI API.
-        stream = client.chat.completions.create(
-            model="gpt-5-chat-latest",
-            messages=messages,
-            stream=True,
-        )
-
-        # Stream the response to the app using `st.write_stream`.
-        st.write_stream(stream)
+        # Generate an answer using the OpenAI API and stream the response
+        # to the app using `st.write_stream`.
+        st.write_stream(chat.stream(messages))
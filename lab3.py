@@ -1,36 +1,16 @@
 import streamlit as st
-from openai import OpenAI
-import anthropic
-import fitz  # PyMuPDF
 
-# pdf extraction
-def extract_text_from_pdf(uploaded_pdf) -> str:
-    doc = fitz.open(stream=uploaded_pdf.read(), filetype="pdf")
-    text = ""
-    for page in doc:
-        text += page.get_text()
-    return text
-
-# lab 3 part b + c
-def conversation_buffer(messages, keep_user_message=2):
-    if not messages:
-        return messages
-
-    # keep system prompt
-    system = []
-    if messages[0]["role"] == "system":
-        system = [messages[0]]
-
-    # find user messages
-    user_indices = [i for i, m in enumerate(messages) if m["role"] == "user"]
-
-    # if <= 2 user messages, keep all
-    if len(user_indices) <= keep_user_message:
-        return messages
-
-    # keep last 2 user turns + responses
-    start_index = user_indices[-keep_user_message]
-    return system + messages[start_index:]
+from chat_memory import (
+    ConversationMemory,
+    SummaryMemory,
+    build_chat_messages,
+    make_openai_summarizer,
+)
+from llm import AnthropicChat, OpenAIChat, format_usage, get_openai_client, prompt_cache_key, text_content
+from pdf_utils import extract_text_from_pdf, iter_pdf_pages
+from summarize import summarize_pages
+from summary_cache import cached_summary_stream, summary_key
+from uploads import MAX_UPLOAD_MB, UploadTooLarge, upload_digest
 
 
 st.title("Lab 3 – Chatbot with Conversational Memory")
@@ -54,11 +34,14 @@ use_advanced_model = st.sidebar.checkbox("Use advanced model")
 openai_api_key = st.secrets["OPENAI_API_KEY"]
 claude_api_key = st.secrets["CLAUDE_API_KEY"]
 
-uploaded_file = st.file_uploader("Upload a PDF", type=("pdf",))
+uploaded_file = st.file_uploader("Upload a PDF", type=("pdf",), max_upload_size=MAX_UPLOAD_MB)
 
-document_text = ""
 if uploaded_file:
-    document_text = extract_text_from_pdf(uploaded_file)
+    try:
+        pdf_hash = upload_digest(uploaded_file)
+    except UploadTooLarge as e:
+        st.error(str(e))
+        st.stop()
 
 instructions = f"{summary_type}. Write the summary in {language}."
 
@@ -75,41 +58,31 @@ SYSTEM_PROMPT = (
 if page == "Summary":
     if uploaded_file:
         if not use_advanced_model:
-            client = OpenAI(api_key=openai_api_key)
-
-            messages = [
-                {
-                    "role": "user",
-                    "content": f"{instructions}\n\nHere's a document:\n{document_text}",
-                }
-            ]
-
-            stream = client.chat.completions.create(
-                model="gpt-5-chat-latest",
-                messages=messages,
-                stream=True,
-            )
-
-            st.write_stream(stream)
-
+            chat = OpenAIChat(openai_api_key, "gpt-5-chat-latest")
         else:
-            client = anthropic.Anthropic(api_key=claude_api_key)
+            chat = AnthropicChat(claude_api_key, "claude-3-sonnet-20240229")
 
-            messages_to_llm = [
-                {
-                    "role": "user",
-                    "content": f"{instructions}\n\nHere's a document:\n{document_text}",
-                }
-            ]
+        # long documents are summarized map-reduce style, the final pass streams.
+        # the pdf is only parsed on a cache miss, page by page, and the pages go
+        # straight into the summarizer, so map requests start before parsing ends
+        def summary_stream():
+            progress = st.progress(0.0, text="Reading PDF...")
 
-            response = client.messages.create(
-                model="claude-3-sonnet-20240229",
-                max_tokens=500,
-                temperature=0,
-                messages=messages_to_llm,
-            )
+            def on_progress(done, total):
+                if done == total:
+                    progress.empty()
+                else:
+                    progress.progress(done / total, text=f"Reading PDF... page {done} of {total}")
 
-            st.markdown(response.content[0].text)
+            pages = (page.text for page in iter_pdf_pages(uploaded_file, on_progress=on_progress))
+            return summarize_pages(chat, pages, instructions)
+
+        # repeat views (reruns, other users) replay the stored summary for free
+        key = summary_key(pdf_hash, summary_type, language, chat.model)
+        try:
+            st.write_stream(cached_summary_stream(key, summary_stream))
+        except UploadTooLarge as e:
+            st.error(str(e))
     else:
         st.info("Upload a PDF to generate a summary.")
 
@@ -118,25 +91,55 @@ elif page == "Chatbot":
     if not uploaded_file:
         st.info("Upload a PDF to chat about it.")
     else:
-        if "client" not in st.session_state:
-            st.session_state.client = OpenAI(api_key=openai_api_key)
+        # the chatbot sends the whole text every turn, so it's extracted
+        # (and cached) in one piece; parsing streams, show progress while it runs
+        progress = st.progress(0.0, text="Reading PDF...")
+        try:
+            document_text = extract_text_from_pdf(
+                uploaded_file,
+                on_progress=lambda done, total: progress.progress(
+                    done / total, text=f"Reading PDF... page {done} of {total}"
+                ),
+            )
+        except UploadTooLarge as e:
+            st.error(str(e))
+            st.stop()
+        finally:
+            progress.empty()
+
+        chat = OpenAIChat(openai_api_key, "gpt-5-chat-latest")
+
+        # "Rolling summary" folds turns that leave the window into a summary
+        memory_mode = st.sidebar.radio("Memory", ["Last 2 turns", "Rolling summary"])
+
+        # lab 3 part b + c: last 2 user turns, trimmed further if over the token budget
+        if st.session_state.get("memory_mode") != memory_mode:
+            if memory_mode == "Rolling summary":
+                new_memory = SummaryMemory(
+                    SYSTEM_PROMPT,
+                    make_openai_summarizer(get_openai_client(openai_api_key)),
+                    keep_user_message=2,
+                )
+            else:
+                new_memory = ConversationMemory(SYSTEM_PROMPT, keep_user_message=2)
 
-        if "messages" not in st.session_state:
-            st.session_state.messages = [
-                {"role": "system", "content": SYSTEM_PROMPT},
-                {"role": "assistant", "content": "How can I help you?"}
-            ]
+            # carry the visible conversation over when switching modes
+            old_memory = st.session_state.get("memory")
+            if old_memory is None:
+                new_memory.append("assistant", "How can I help you?")
+            else:
+                for msg in old_memory.history():
+                    new_memory.append(msg["role"], msg["content"])
+
+            st.session_state.memory = new_memory
+            st.session_state.memory_mode = memory_mode
+
+        memory = st.session_state.memory
 
         if "awaiting_more_info" not in st.session_state:
             st.session_state.awaiting_more_info = False
 
-        st.session_state.messages = conversation_buffer(
-            st.session_state.messages, keep_user_message=2
-        )
-
-        for msg in st.session_state.messages:
-            if msg["role"] == "system":
-                continue
+        for msg in memory.history():
             chat_msg = st.chat_message(msg["role"])
             chat_msg.write(msg["content"])
 
@@ -144,7 +147,7 @@ elif page == "Chatbot":
             normalized = prompt.strip().lower()
 
             if st.session_state.awaiting_more_info and normalized in ["no", "n", "nope", "nah"]:
-                st.session_state.messages.append({"role": "user", "content": prompt})
+                memory.append("user", prompt)
 
                 with st.chat_message("user"):
                     st.markdown(prompt)
@@ -154,49 +157,38 @@ elif page == "Chatbot":
                 with st.chat_message("assistant"):
                     st.markdown(assistant_text)
 
-                st.session_state.messages.append({"role": "assistant", "content": assistant_text})
+                memory.append("assistant", assistant_text)
 
                 st.session_state.awaiting_more_info = False
 
-                st.session_state.messages = conversation_buffer(
-                    st.session_state.messages, keep_user_message=2
-                )
-
             else:
-                st.session_state.messages.append({"role": "user", "content": prompt})
+                memory.append("user", prompt)
 
                 with st.chat_message("user"):
                     st.markdown(prompt)
 
-                buffered_history = conversation_buffer(
-                    st.session_state.messages, keep_user_message=2
-                )
-
-                messages_for_llm = [
-                    {
-                        "role": "user",
-                        "content": f"{instructions}\n\nHere's a document:\n{document_text}",
-                    }
-                ] + buffered_history
-
-                client = st.session_state.client
+                # system prompt + document form a prefix that is identical every turn,
+                # so the provider can serve it from its prompt cache
+                document_message = {
+                    "role": "user",
+                    "content": text_content(f"{instructions}\n\nHere's a document:\n", document_text),
+                }
+                messages_for_llm = build_chat_messages(memory, document_message)
 
-                stream = client.chat.completions.create(
-                    model="gpt-5-chat-latest",
-                    messages=messages_for_llm,
-                    stream=True,
+                usage = {}
+                stream = chat.stream(
+                    messages_for_llm,
+                    usage=usage,
+                    cache_key=prompt_cache_key(SYSTEM_PROMPT, instructions, document_text),
                 )
 
                 with st.chat_message("assistant"):
                     response = st.write_stream(stream)
+                    st.caption(format_usage(usage))
 
-                st.session_state.messages.append({"role": "assistant", "content": response})
+                memory.append("assistant", response)
 
                 if normalized in ["no", "n", "nope", "nah"]:
                     st.session_state.awaiting_more_info = False
                 else:
                     st.session_state.awaiting_more_info = True
-
-                st.session_state.messages = conversation_buffer(
-                    st.session_state.messages, keep_user_message=2
-                )
@@ -1,95 +1,12 @@
-import sys
-
-
-try:
-    import pysqlite3
-    sys.modules["sqlite3"] = pysqlite3
-except Exception:
-    pass
-
-import os
-import chromadb 
-from chromadb.utils import embedding_functions
 import streamlit as st
-from openai import OpenAI
-import anthropic
-import fitz  # PyMuPDF
-
-# pdf extraction
-def extract_text_from_pdf(uploaded_pdf) -> str:
-    doc = fitz.open(stream=uploaded_pdf.read(), filetype="pdf")
-    text = ""
-    for page in doc:
-        text += page.get_text()
-    return text
-
-
-
-# lab 3 part b + c
-def conversation_buffer(messages, keep_user_message=2):
-    if not messages:
-        return messages
-
-    # keep system prompt
-    system = []
-    if messages[0]["role"] == "system":
-        system = [messages[0]]
-
-    # find user messages
-    user_indices = [i for i, m in enumerate(messages) if m["role"] == "user"]
-
-    # if <= 2 user messages, keep all
-    if len(user_indices) <= keep_user_message:
-        return messages
-
-    # keep last 2 user turns + responses
-    start_index = user_indices[-keep_user_message]
-    return system + messages[start_index:]
-
-
-# lab 4 - RAG
-def create_lab4_vectordb(pdf_folder: str):
-    client = chromadb.PersistentClient(path="./chroma_lab4")
-
-    embed_fn = embedding_functions.OpenAIEmbeddingFunction(
-        api_key=st.secrets["OPENAI_API_KEY"],
-        model_name="text-embedding-3-small",
-    )
 
-    collection = client.get_or_create_collection(
-        name="Lab4Collection",
-        embedding_function=embed_fn,
-    )
+from chunking import format_source
+from context_packer import pack_context
+from llm import OpenAIChat, format_usage
+from pdf_utils import extract_text_from_pdf
+from rag import build_rag_messages, get_lab4_store, lab4_store_error, lab4_store_state, start_lab4_warmup
+from uploads import MAX_UPLOAD_MB, UploadTooLarge
 
-    existing = set(collection.get(include=[])["ids"])
-
-    for filename in os.listdir(pdf_folder):
-        if not filename.lower().endswith(".pdf"):
-            continue
-
-        if filename in existing:
-            continue
-
-        with open(os.path.join(pdf_folder, filename), "rb") as f:
-            text = extract_text_from_pdf(f)
-
-        collection.add(
-            ids=[filename],
-            documents=[text],
-            metadatas=[{"source": filename}],
-        )
-
-    return collection
-
-def retrieve_top_docs(question: str, n_results: int = 3):
-    results = st.session_state.Lab4_VectorDB.query(
-        query_texts=[question],
-        n_results=n_results,
-        include=["documents", "metadatas"],
-    )
-    docs = results["documents"][0]
-    sources = [m["source"] for m in results["metadatas"][0]]
-    return docs, sources
 
 st.title("Lab 4 – RAG")
 
@@ -112,11 +29,24 @@ use_advanced_model = st.sidebar.checkbox("Use advanced model")
 openai_api_key = st.secrets["OPENAI_API_KEY"]
 claude_api_key = st.secrets["CLAUDE_API_KEY"]
 
-uploaded_file = st.file_uploader("Upload a PDF", type=("pdf",))
+uploaded_file = st.file_uploader("Upload a PDF", type=("pdf",), max_upload_size=MAX_UPLOAD_MB)
 
 document_text = ""
 if uploaded_file:
-    document_text = extract_text_from_pdf(uploaded_file)
+    # parsing streams page by page, show progress while it runs
+    progress = st.progress(0.0, text="Reading PDF...")
+    try:
+        document_text = extract_text_from_pdf(
+            uploaded_file,
+            on_progress=lambda done, total: progress.progress(
+                done / total, text=f"Reading PDF... page {done} of {total}"
+            ),
+        )
+    except UploadTooLarge as e:
+        st.error(str(e))
+        st.stop()
+    finally:
+        progress.empty()
 
 instructions = f"{summary_type}. Write the summary in {language}."
 
@@ -130,49 +60,57 @@ SYSTEM_PROMPT = (
 )
 
 if page == "Lab4":
-    PDF_FOLDER = "lab4_pdfs"
-
-    if "Lab4_VectorDB" not in st.session_state:
-        st.session_state.Lab4_VectorDB = create_lab4_vectordb(PDF_FOLDER)
+    # one store per process, shared by all sessions, built in the background
+    # at startup; until it's ready the page shows a status instead of blocking
+    if lab4_store_state() != "ready":
+        if lab4_store_state() == "cold":
+            start_lab4_warmup()
+
+        @st.fragment(run_every=1.0)
+        def store_status():
+            state = lab4_store_state()
+            if state == "ready":
+                st.rerun()
+            elif state == "error":
+                st.error(f"Could not build the syllabus index: {lab4_store_error()}")
+                if st.button("Try again"):
+                    start_lab4_warmup(retry=True)
+            else:
+                st.info("Warming up the syllabus index, the chatbot will appear here when it's ready...")
+
+        store_status()
+        st.stop()
+
+    store = get_lab4_store()
+
+    if st.sidebar.button("Refresh syllabus index"):
+        st.sidebar.write(store.refresh())
+
+    with st.sidebar.expander("Retrieval cache"):
+        st.write(store.cache_stats())
 
     test_query = st.text_input("Test search (remove after you validate)", "")
     if test_query:
-        results = st.session_state.Lab4_VectorDB.query(
-            query_texts=[test_query],
-            n_results=3,
-            include=["metadatas"],
-        )
-        st.write("Top 3 documents:")
-        for i, meta in enumerate(results["metadatas"][0], start=1):
-            st.write(f"{i}. {meta['source']}")
+        st.write("Top 3 chunks:")
+        for i, hit in enumerate(store.search(test_query, n_results=3), start=1):
+            st.write(f"{i}. {format_source(hit['metadata'])}")
 
     st.divider()
     st.subheader("Course Chatbot (RAG)")
 
     rag_question = st.chat_input("Ask a question about the syllabi...")
     if rag_question:
-        docs, sources = retrieve_top_docs(rag_question, n_results=3)
+        # retrieve a few extra candidates, then pack the best ones into a fixed token budget
+        hits = store.search(rag_question, n_results=8)
+        context, sources = pack_context(rag_question, hits, store.embedding_function)
 
-        context = "\n\n---\n\n".join(docs)
+        chat = OpenAIChat(openai_api_key, "gpt-5-mini")
 
-        rag_prompt = (
-            "You are a course information chatbot.\n"
-            "Use the RAG context below to answer.\n"
-            "Be clear when you are using knowledge from the RAG context.\n"
-            "If the answer is not in the RAG context, say you cannot find it.\n\n"
-            f"RAG CONTEXT:\n{context}\n\n"
-            f"QUESTION:\n{rag_question}\n"
-        )
-
-        client = OpenAI(api_key=openai_api_key)
-
-        stream = client.chat.completions.create(
-            model="gpt-5-mini",
-            messages=[{"role": "user", "content": rag_prompt}],
-            stream=True,
-        )
+        usage = {}
+        stream = chat.stream(build_rag_messages(context, rag_question), usage=usage)
 
         with st.chat_message("assistant"):
             st.write_stream(stream)
+            st.caption(format_usage(usage))
 
         st.write("Sources:", sources)
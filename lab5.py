@@ -6,45 +6,30 @@ try:
 except Exception:
     pass
 
+import csv
+import io
 import json
-import requests
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
 import streamlit as st
-from openai import OpenAI
+
+from llm import get_openai_client
+from metrics import timed
+from tools import ToolRegistry, run_tool_loop
+from uploads import MAX_UPLOAD_MB, read_text
+from weather import get_weather_client, normalize_location
+
+# batch mode: weather lookups are also limited by the client's rate limiter
+BATCH_WEATHER_WORKERS = 16
+BATCH_LLM_WORKERS = 8
 
 
 # Part A: Weather function location in form City, State, Country
 # default units is Fahrenheit
+# requests go through a pooled, cached client (see weather.py)
 def get_current_weather(location, api_key, units="imperial"):
-    url = (
-        f"https://api.openweathermap.org/data/2.5/weather"
-        f"?q={location}&appid={api_key}&units={units}"
-    )
-    response = requests.get(url, timeout=20)
-
-    if response.status_code == 401:
-        raise Exception("Authentication failed: Invalid API key (401 Unauthorized)")
-    if response.status_code == 404:
-        error_message = response.json().get("message")
-        raise Exception(f"404 error: {error_message}")
-
-    data = response.json()
-
-    temp = data["main"]["temp"]
-    feels_like = data["main"]["feels_like"]
-    temp_min = data["main"]["temp_min"]
-    temp_max = data["main"]["temp_max"]
-    humidity = data["main"]["humidity"]
-    description = data["weather"][0]["description"]
-
-    return {
-        "location": location,
-        "temperature": round(temp, 2),
-        "feels_like": round(feels_like, 2),
-        "temp_min": round(temp_min, 2),
-        "temp_max": round(temp_max, 2),
-        "humidity": round(humidity, 2),
-        "description": description,
-    }
+    return get_weather_client(api_key).get(location, units)
 
 
 # Part B: Define the tool
@@ -69,13 +54,166 @@ weather_tool = [
 ]
 
 
+# Step 7b: Default to Syracuse, NY if no location provided
+def weather_tool_fn(location=""):
+    return get_current_weather(location.strip() or "Syracuse, NY", weather_api_key)
+
+
+# Batch mode: locations from the text box and/or an uploaded csv/jsonl
+# a malformed file raises ValueError naming the line
+def parse_locations(text, uploaded_file=None):
+    locations = [line.strip() for line in text.splitlines()]
+
+    if uploaded_file is not None:
+        # decoded from the upload buffer, raises UploadTooLarge over MAX_UPLOAD_MB
+        content = read_text(uploaded_file)
+        if uploaded_file.name.lower().endswith(".jsonl"):
+            for line_number, line in enumerate(content.splitlines(), start=1):
+                if not line.strip():
+                    continue
+                try:
+                    row = json.loads(line)
+                    locations.append(str(row.get("location") or row.get("city") or ""))
+                except (ValueError, AttributeError) as e:
+                    raise ValueError(
+                        f"{uploaded_file.name}, line {line_number}: expected a JSON object ({e})"
+                    ) from e
+        else:
+            # a "location" or "city" column, otherwise the first column
+            reader = csv.reader(io.StringIO(content))
+            try:
+                rows = list(reader)
+            except csv.Error as e:
+                raise ValueError(f"{uploaded_file.name}, line {reader.line_num}: {e}") from e
+            header = [cell.strip().lower() for cell in rows[0]] if rows else []
+            column = next((header.index(name) for name in ("location", "city") if name in header), None)
+            if column is None:
+                column = 0
+            else:
+                rows = rows[1:]
+            locations.extend(row[column] for row in rows if len(row) > column)
+
+    # drop blanks and duplicates, keep the order
+    seen = set()
+    unique = []
+    for location in locations:
+        location = location.strip()
+        key = normalize_location(location)
+        if key and key not in seen:
+            seen.add(key)
+            unique.append(location)
+    return unique
+
+
+# same prompt as the second call (8a), weather is already known
+def advise(weather):
+    with timed("llm_complete", model="gpt-5-mini"):
+        response = get_openai_client(openai_api_key).chat.completions.create(
+            model="gpt-5-mini",
+            messages=[
+                {
+                    "role": "system",
+                    "content": (
+                        "You are a 'What to Wear' assistant. "
+                        "Use the provided weather information to answer."
+                    ),
+                },
+                {
+                    "role": "user",
+                    "content": (
+                        f"Weather info: {weather}\n\n"
+                        "Based on this weather, suggest what clothes to wear today "
+                        "and suggest outdoor activities that are appropriate. Keep it short."
+                    ),
+                },
+            ],
+        )
+        return response.choices[0].message.content or ""
+
+
+def batch_advice(locations):
+    """Yield (location, weather, advice, error) as each location finishes.
+
+    Weather lookups run on one pool, and each finished lookup is handed
+    straight to a bounded LLM pool. Results come back in completion
+    order on the calling (script) thread.
+    """
+    weather_pool = ThreadPoolExecutor(BATCH_WEATHER_WORKERS, thread_name_prefix="batch-weather")
+    llm_pool = ThreadPoolExecutor(BATCH_LLM_WORKERS, thread_name_prefix="batch-llm")
+    pending = {
+        weather_pool.submit(get_current_weather, location, weather_api_key): (location, None)
+        for location in locations
+    }
+    try:
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                location, weather = pending.pop(future)
+                error = future.exception()
+                if error is not None:
+                    yield location, weather, None, str(error)
+                elif weather is None:
+                    weather = future.result()
+                    pending[llm_pool.submit(advise, weather)] = (location, weather)
+                else:
+                    yield location, weather, future.result(), None
+    finally:
+        # also runs when the user stops the script mid-batch
+        weather_pool.shutdown(wait=False, cancel_futures=True)
+        llm_pool.shutdown(wait=False, cancel_futures=True)
+
+
 # UI
 st.title("Lab 05 — The 'What to Wear' Bot")
 
 openai_api_key = st.secrets["OPENAI_API_KEY"]
 weather_api_key = st.secrets["OPENWEATHER_API_KEY"]
 
-client = OpenAI(api_key=openai_api_key)
+with st.sidebar.expander("Weather cache"):
+    weather_stats = get_weather_client(weather_api_key).stats()
+    st.write(
+        f"Hits: {weather_stats['hits']} (stale: {weather_stats['stale_hits']}) · "
+        f"misses: {weather_stats['misses']} · coalesced: {weather_stats['coalesced']}"
+    )
+    st.write(
+        f"Requests: {weather_stats['fetches']} · errors: {weather_stats['errors']} · "
+        f"avg latency: {weather_stats['avg_fetch_ms']:.0f} ms"
+    )
+
+mode = st.radio("Mode", ["Single city", "Batch"], horizontal=True)
+
+if mode == "Batch":
+    locations_text = st.text_area("Locations, one per line", "")
+    locations_file = st.file_uploader(
+        "Or upload a list (CSV or JSONL)", type=("csv", "jsonl"), max_upload_size=MAX_UPLOAD_MB
+    )
+    try:
+        locations = parse_locations(locations_text, locations_file)
+    except ValueError as e:
+        # a malformed file, or UploadTooLarge
+        st.error(str(e))
+        st.stop()
+    st.caption(f"{len(locations)} locations")
+
+    if st.button("Get What to Wear Advice", disabled=not locations):
+        progress = st.progress(0.0)
+        table = st.empty()
+        rows = []
+        started = time.perf_counter()
+
+        for location, weather, advice, error in batch_advice(locations):
+            rows.append({
+                "location": location,
+                "temperature": weather["temperature"] if weather else None,
+                "conditions": weather["description"] if weather else None,
+                "advice": advice if error is None else f"error: {error}",
+            })
+            progress.progress(len(rows) / len(locations), text=f"{len(rows)}/{len(locations)} done")
+            table.dataframe(rows, use_container_width=True)
+
+        st.caption(f"Finished {len(rows)} locations in {time.perf_counter() - started:.1f}s")
+
+    st.stop()
 
 city = st.text_input("Enter a city (example: Syracuse, NY, US)", "")
 
@@ -103,68 +241,24 @@ if st.button("Get What to Wear Advice"):
         },
     ]
 
-    try:
-        first_resp = client.chat.completions.create(
-            model="gpt-5-mini",
-            messages=messages,
-            tools=weather_tool,
-            tool_choice="auto",
-        )
-
-        msg = first_resp.choices[0].message
-
-        # If model requests the tool, run it then make a second call (8)
-        tool_calls = getattr(msg, "tool_calls", None)
-
-        if tool_calls:
-            # only defined one tool, so handle the first request
-            tool_call = tool_calls[0]
-            args = {}
-            try:
-                args = json.loads(tool_call.function.arguments or "{}")
-            except Exception:
-                args = {}
-
-            # Step 7b: Default to Syracuse, NY if no location provided
-            requested_location = (args.get("location") or "").strip()
-            if not requested_location:
-                requested_location = "Syracuse, NY"
+    # tool round trips: the model may ask for several locations at once,
+    # all calls of a round run in parallel and go back as tool messages
+    registry = ToolRegistry()
+    registry.register(weather_tool[0], weather_tool_fn)
 
-            weather = get_current_weather(requested_location, weather_api_key)
-
-            # Second call: Provide weather info as part of the prompt (8a)
-            messages_2 = [
-                {
-                    "role": "system",
-                    "content": (
-                        "You are a 'What to Wear' assistant. "
-                        "Use the provided weather information to answer."
-                    ),
-                },
-                {
-                    "role": "user",
-                    "content": (
-                        f"Weather info: {weather}\n\n"
-                        "Based on this weather, suggest what clothes to wear today "
-                        "and suggest outdoor activities that are appropriate."
-                    ),
-                },
-            ]
-
-            second_resp = client.chat.completions.create(
-                model="gpt-5-mini",
-                messages=messages_2,
-            )
+    try:
+        # pooled client, reused across reruns (openai is only imported here)
+        client = get_openai_client(openai_api_key)
+        final_answer, tool_trace = run_tool_loop(client, "gpt-5-mini", messages, registry)
 
-            final_answer = second_resp.choices[0].message.content or ""
-            st.subheader("Recommendation")
-            st.write(final_answer)
+        st.subheader("Recommendation")
+        st.write(final_answer)
 
-        else:
-            # If tool wasn't invoked, just show the model's response
-            # tool_choice='auto' only calls weather when needed
-            st.subheader("Recommendation")
-            st.write(msg.content or "")
+        if tool_trace:
+            with st.expander("Tool calls"):
+                for call in tool_trace:
+                    status = f"error: {call['error']}" if call["error"] else "ok"
+                    st.write(f"`{call['tool']}({call['arguments']})` — {call['seconds']:.2f}s, {status}")
 
     except Exception as e:
         st.error(str(e))
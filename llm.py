@@ -0,0 +1,300 @@
+import asyncio
+import hashlib
+import inspect
+import threading
+import time
+from collections import OrderedDict
+
+import metrics
+from caching import update_digest
+
+# one set of clients per api key, so HTTP connection pools and TLS sessions
+# survive script reruns and are shared by sessions. keys can come from
+# visitors (lab 1), so only the MAX_POOLED_KEYS most recently used keys
+# keep their clients, older ones are closed.
+# the sdks retry connection errors, 408/409/429 and 5xx with exponential
+# backoff up to LLM_MAX_RETRIES times.
+# the sdks are imported with the first client, pages that never call a
+# provider don't pay for them
+LLM_TIMEOUT_SECONDS = 120.0
+LLM_MAX_RETRIES = 3
+MAX_POOLED_KEYS = 8
+
+_clients = OrderedDict()
+_clients_lock = threading.Lock()
+
+
+def _close(client):
+    close = client.close()
+    if inspect.iscoroutine(close):
+        # async clients are used on the shared loop, close them there
+        submit_coroutine(close)
+
+
+def _pooled(kind, api_key, factory):
+    key = (kind, api_key)
+    evicted = []
+    with _clients_lock:
+        client = _clients.get(key)
+        if client is None:
+            client = _clients[key] = factory(
+                api_key=api_key,
+                timeout=LLM_TIMEOUT_SECONDS,
+                max_retries=LLM_MAX_RETRIES,
+            )
+            # counted per kind, each kind keeps its MAX_POOLED_KEYS latest keys
+            same_kind = [k for k in _clients if k[0] == kind]
+            for old_key in same_kind[:-MAX_POOLED_KEYS]:
+                evicted.append(_clients.pop(old_key))
+        else:
+            _clients.move_to_end(key)
+
+    for old in evicted:
+        _close(old)
+    return client
+
+
+def get_openai_client(api_key):
+    from openai import OpenAI
+    return _pooled("openai", api_key, OpenAI)
+
+
+def get_async_openai_client(api_key):
+    from openai import AsyncOpenAI
+    return _pooled("openai-async", api_key, AsyncOpenAI)
+
+
+def get_anthropic_client(api_key):
+    import anthropic
+    return _pooled("anthropic", api_key, anthropic.Anthropic)
+
+
+def get_async_anthropic_client(api_key):
+    import anthropic
+    return _pooled("anthropic-async", api_key, anthropic.AsyncAnthropic)
+
+
+def prompt_cache_key(*parts):
+    """Short stable id for a prompt prefix, used as the provider cache key."""
+    digest = hashlib.sha256()
+    for part in parts:
+        update_digest(digest, part)
+        digest.update(b"\0")
+    return digest.hexdigest()[:32]
+
+
+def text_content(*texts):
+    """Message content as a list of text parts (same shape for both providers).
+
+    Lets a long document go into a message as-is, instead of being copied
+    into one f-string together with the instructions around it.
+    """
+    return [{"type": "text", "text": text} for text in texts if text]
+
+
+def read_usage(usage_obj, usage):
+    usage["prompt_tokens"] = usage_obj.prompt_tokens
+    usage["completion_tokens"] = usage_obj.completion_tokens
+    details = getattr(usage_obj, "prompt_tokens_details", None)
+    usage["cached_tokens"] = getattr(details, "cached_tokens", 0) or 0
+
+
+def iter_openai_text(stream, usage=None):
+    """Yield the text of a chat completions stream.
+
+    Request the stream with stream_options={"include_usage": True} and pass
+    a dict as `usage` to get prompt/completion/cached token counts from the
+    final chunk.
+    """
+    for chunk in stream:
+        if usage is not None and getattr(chunk, "usage", None) is not None:
+            read_usage(chunk.usage, usage)
+        if chunk.choices:
+            text = chunk.choices[0].delta.content
+            if text:
+                yield text
+
+
+def _timed(text_stream, usage, started):
+    # time to first token and total time, measured from the request start
+    for text in text_stream:
+        if "ttft_s" not in usage:
+            usage["ttft_s"] = time.perf_counter() - started
+        yield text
+    usage["total_s"] = time.perf_counter() - started
+
+
+def _record_stream(model, usage):
+    if not metrics.enabled() or "total_s" not in usage:
+        return
+    tokens = {
+        name: usage.get(name, 0)
+        for name in ("prompt_tokens", "completion_tokens", "cached_tokens")
+    }
+    metrics.record("llm_stream", usage["total_s"], model=model, ttft_s=usage.get("ttft_s"), **tokens)
+    if "ttft_s" in usage:
+        metrics.record("llm_ttft", usage["ttft_s"], model=model)
+    for name, value in tokens.items():
+        metrics.incr(name, value)
+
+
+def format_usage(usage):
+    if not usage or "prompt_tokens" not in usage:
+        return ""
+    text = (
+        f"Prompt tokens: {usage['prompt_tokens']} "
+        f"(cached: {usage['cached_tokens']}) · "
+        f"completion tokens: {usage['completion_tokens']}"
+    )
+    if "ttft_s" in usage:
+        text += f" · first token {usage['ttft_s']:.2f}s, total {usage['total_s']:.2f}s"
+    return text
+
+
+# shared event loop for the async clients, so async work (map-reduce
+# summaries, tool calls) can be started from the synchronous page scripts
+_loop = None
+_loop_lock = threading.Lock()
+
+
+def _get_loop():
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name="llm-loop", daemon=True).start()
+        return _loop
+
+
+def submit_coroutine(coro):
+    """Schedule coro on the shared background loop, returns a concurrent Future."""
+    return asyncio.run_coroutine_threadsafe(coro, _get_loop())
+
+
+def run_coroutine(coro):
+    """Run coro on the shared background loop and wait for its result."""
+    return submit_coroutine(coro).result()
+
+
+def _split_system(messages):
+    # anthropic takes the system prompt as a separate argument; later system
+    # messages (e.g. the rolling chat summary) are sent as user messages so
+    # the cached prefix doesn't change with them
+    leading = 0
+    while leading < len(messages) and messages[leading]["role"] == "system":
+        leading += 1
+    system = "\n\n".join(m["content"] for m in messages[:leading])
+    rest = [
+        m if m["role"] != "system" else {"role": "user", "content": m["content"]}
+        for m in messages[leading:]
+    ]
+    return system, rest
+
+
+class OpenAIChat:
+    """Streaming + async completions over the pooled OpenAI clients."""
+
+    def __init__(self, api_key, model, reasoning_effort=None):
+        self.model = model
+        # "minimal" / "low" / ... for reasoning models, None = the model default
+        self.reasoning_effort = reasoning_effort
+        self.client = get_openai_client(api_key)
+        self.async_client = get_async_openai_client(api_key)
+
+    def _kwargs(self, messages, max_tokens, cache_key):
+        kwargs = {"model": self.model, "messages": messages}
+        if max_tokens:
+            # reasoning models spend this on reasoning tokens too
+            kwargs["max_completion_tokens"] = max_tokens
+        if self.reasoning_effort:
+            kwargs["reasoning_effort"] = self.reasoning_effort
+        if cache_key:
+            kwargs["extra_body"] = {"prompt_cache_key": cache_key}
+        return kwargs
+
+    def stream(self, messages, max_tokens=None, usage=None, cache_key=None):
+        """Yield response text; fills `usage` with tokens, ttft_s and total_s.
+
+        cache_key groups requests that share a prompt prefix so the
+        provider can serve the prefix from its prompt cache.
+        """
+        usage = {} if usage is None else usage
+        started = time.perf_counter()
+        stream = self.client.chat.completions.create(
+            stream=True,
+            stream_options={"include_usage": True},
+            **self._kwargs(messages, max_tokens, cache_key),
+        )
+        yield from _timed(iter_openai_text(stream, usage), usage, started)
+        _record_stream(self.model, usage)
+
+    async def acomplete(self, messages, max_tokens=None, cache_key=None, usage=None):
+        """Return the response text; fills `usage` with tokens and finish_reason."""
+        with metrics.timed("llm_complete", model=self.model) as fields:
+            response = await self.async_client.chat.completions.create(
+                **self._kwargs(messages, max_tokens, cache_key)
+            )
+            if response.usage is not None:
+                read_usage(response.usage, fields)
+            if usage is not None:
+                if response.usage is not None:
+                    read_usage(response.usage, usage)
+                usage["finish_reason"] = response.choices[0].finish_reason
+            return response.choices[0].message.content or ""
+
+
+class AnthropicChat:
+    """Same interface as OpenAIChat over the pooled Anthropic clients."""
+
+    def __init__(self, api_key, model, temperature=0):
+        self.model = model
+        self.temperature = temperature
+        self.client = get_anthropic_client(api_key)
+        self.async_client = get_async_anthropic_client(api_key)
+
+    def _kwargs(self, messages, max_tokens, cache_key):
+        system, rest = _split_system(messages)
+        if cache_key and rest:
+            # mark the end of the stable prefix (system + first message) as cacheable
+            first = rest[0]
+            parts = first["content"]
+            if isinstance(parts, str):
+                parts = text_content(parts)
+            parts = parts[:-1] + [dict(parts[-1], cache_control={"type": "ephemeral"})]
+            rest = [{"role": first["role"], "content": parts}] + rest[1:]
+
+        kwargs = {
+            "model": self.model,
+            "max_tokens": max_tokens or 2048,
+            "temperature": self.temperature,
+            "messages": rest,
+        }
+        if system:
+            kwargs["system"] = system
+        return kwargs
+
+    def stream(self, messages, max_tokens=None, usage=None, cache_key=None):
+        usage = {} if usage is None else usage
+        started = time.perf_counter()
+        with self.client.messages.stream(**self._kwargs(messages, max_tokens, cache_key)) as stream:
+            yield from _timed(stream.text_stream, usage, started)
+            final = stream.get_final_message().usage
+            usage["prompt_tokens"] = final.input_tokens
+            usage["completion_tokens"] = final.output_tokens
+            usage["cached_tokens"] = getattr(final, "cache_read_input_tokens", 0) or 0
+        _record_stream(self.model, usage)
+
+    async def acomplete(self, messages, max_tokens=None, cache_key=None, usage=None):
+        with metrics.timed("llm_complete", model=self.model) as fields:
+            response = await self.async_client.messages.create(
+                **self._kwargs(messages, max_tokens, cache_key)
+            )
+            fields["prompt_tokens"] = response.usage.input_tokens
+            fields["completion_tokens"] = response.usage.output_tokens
+            if usage is not None:
+                usage["prompt_tokens"] = response.usage.input_tokens
+                usage["completion_tokens"] = response.usage.output_tokens
+                # same finish_reason as openai for a cut off answer
+                usage["finish_reason"] = "length" if response.stop_reason == "max_tokens" else response.stop_reason
+            return "".join(block.text for block in response.content if block.type == "text")
+
@@ -0,0 +1,256 @@
+import json
+import math
+import os
+import tempfile
+import threading
+import time
+from collections import deque
+
+# per-stage timings and counters for the lab pages (pdf extraction,
+# embedding, retrieval, llm calls, weather). off unless LAB_METRICS=1 or
+# enable() is called; when off timed() hands back a shared no-op object
+METRICS_ENABLED = os.environ.get("LAB_METRICS", "") not in ("", "0")
+METRICS_JSONL_PATH = os.path.join(".cache", "metrics.jsonl")
+METRICS_PROM_PATH = os.path.join(".cache", "metrics.prom")
+METRICS_PROM_INTERVAL = 5.0
+METRICS_SAMPLES = 500
+# the jsonl log is rotated to metrics.jsonl.1 (replacing the previous one)
+# once it grows past this size
+METRICS_JSONL_MAX_BYTES = int(os.environ.get("LAB_METRICS_LOG_MB", "16")) * 1024 * 1024
+# start/stop and reset act on the whole process, so the panel only shows
+# them when LAB_METRICS_CONTROLS=1 (e.g. on a local or admin deployment)
+METRICS_CONTROLS = os.environ.get("LAB_METRICS_CONTROLS", "") not in ("", "0")
+
+_enabled = METRICS_ENABLED
+_lock = threading.Lock()
+_stages = {}
+_counters = {}
+_jsonl = None
+_prom_written = 0.0
+
+
+def enable(on=True):
+    global _enabled
+    _enabled = on
+
+
+def enabled():
+    return _enabled
+
+
+def incr(name, value=1):
+    if not _enabled:
+        return
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + value
+
+
+def record(stage, seconds, **fields):
+    """Record one timed event for `stage` (extra fields go to the jsonl log)."""
+    if not _enabled:
+        return
+    global _jsonl, _prom_written
+
+    event = {"ts": time.time(), "stage": stage, "seconds": round(seconds, 6)}
+    event.update(fields)
+    line = json.dumps(event, default=str) + "\n"
+
+    with _lock:
+        stats = _stages.get(stage)
+        if stats is None:
+            stats = _stages[stage] = {
+                "count": 0,
+                "errors": 0,
+                "total_s": 0.0,
+                "max_s": 0.0,
+                "samples": deque(maxlen=METRICS_SAMPLES),
+            }
+        stats["count"] += 1
+        stats["errors"] += 1 if fields.get("error") else 0
+        stats["total_s"] += seconds
+        stats["max_s"] = max(stats["max_s"], seconds)
+        stats["samples"].append(seconds)
+
+        # a full disk or read-only .cache must never fail the measured call
+        try:
+            if _jsonl is None:
+                os.makedirs(os.path.dirname(METRICS_JSONL_PATH), exist_ok=True)
+                _jsonl = open(METRICS_JSONL_PATH, "a", encoding="utf-8")
+            _jsonl.write(line)
+            _jsonl.flush()
+            if _jsonl.tell() > METRICS_JSONL_MAX_BYTES:
+                _jsonl.close()
+                _jsonl = None
+                os.replace(METRICS_JSONL_PATH, METRICS_JSONL_PATH + ".1")
+        except OSError:
+            pass
+
+        # one thread per interval claims the export
+        now = time.monotonic()
+        export = now - _prom_written > METRICS_PROM_INTERVAL
+        if export:
+            _prom_written = now
+
+    if export:
+        try:
+            write_prometheus()
+        except OSError:
+            pass
+
+
+class _Timer:
+    __slots__ = ("stage", "fields", "started")
+
+    def __init__(self, stage, fields):
+        self.stage = stage
+        self.fields = fields
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self.fields
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.fields["error"] = exc_type.__name__
+        record(self.stage, time.perf_counter() - self.started, **self.fields)
+        return False
+
+
+class _NoopTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        # fields set by the caller are thrown away
+        return {}
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NOOP = _NoopTimer()
+
+
+def timed(stage, **fields):
+    """with timed("retrieve", n_results=3) as fields: ...
+
+    The block may add fields (e.g. token counts) to the yielded dict.
+    """
+    if not _enabled:
+        return _NOOP
+    return _Timer(stage, fields)
+
+
+def _percentile(sorted_samples, q):
+    if not sorted_samples:
+        return 0.0
+    # nearest rank
+    return sorted_samples[max(0, math.ceil(q * len(sorted_samples)) - 1)]
+
+
+def snapshot():
+    """Per-stage summaries (count, errors, avg/p50/p95/max ms) and counters."""
+    with _lock:
+        stages = {}
+        for stage, stats in _stages.items():
+            samples = sorted(stats["samples"])
+            stages[stage] = {
+                "count": stats["count"],
+                "errors": stats["errors"],
+                "avg_ms": 1000 * stats["total_s"] / stats["count"],
+                "p50_ms": 1000 * _percentile(samples, 0.50),
+                "p95_ms": 1000 * _percentile(samples, 0.95),
+                "max_ms": 1000 * stats["max_s"],
+            }
+        return {"stages": stages, "counters": dict(_counters)}
+
+
+def reset():
+    with _lock:
+        _stages.clear()
+        _counters.clear()
+
+
+def prometheus_text():
+    snap = snapshot()
+    lines = [
+        "# TYPE lab_stage_seconds_total counter",
+        "# TYPE lab_stage_calls_total counter",
+        "# TYPE lab_stage_errors_total counter",
+        "# TYPE lab_stage_p95_seconds gauge",
+    ]
+    with _lock:
+        totals = {stage: stats["total_s"] for stage, stats in _stages.items()}
+    for stage, stats in sorted(snap["stages"].items()):
+        label = f'{{stage="{stage}"}}'
+        lines.append(f"lab_stage_seconds_total{label} {totals[stage]:.6f}")
+        lines.append(f"lab_stage_calls_total{label} {stats['count']}")
+        lines.append(f"lab_stage_errors_total{label} {stats['errors']}")
+        lines.append(f"lab_stage_p95_seconds{label} {stats['p95_ms'] / 1000:.6f}")
+
+    lines.append("# TYPE lab_counter_total counter")
+    for name, value in sorted(snap["counters"].items()):
+        lines.append(f'lab_counter_total{{name="{name}"}} {value}')
+    return "\n".join(lines) + "\n"
+
+
+def write_prometheus(path=METRICS_PROM_PATH):
+    """Write the text exposition format for a node_exporter textfile collector."""
+    directory = os.path.dirname(path) or "."
+    os.makedirs(directory, exist_ok=True)
+    # a temp file per call, so concurrent exports never rename each other's
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(prometheus_text())
+        # mkstemp creates 0600, the collector may run as another user
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+def metrics_panel():
+    """Sidebar on/off button plus per-stage table, for the streamlit pages."""
+    import streamlit as st
+
+    with st.sidebar.expander("Metrics"):
+        # recording is process-wide, so the control is a plain button and
+        # every session just shows the current state (no per-session widget)
+        if METRICS_CONTROLS and st.button("Stop recording" if _enabled else "Start recording"):
+            enable(not _enabled)
+            st.rerun()
+        if not _enabled:
+            st.caption(
+                "Off for every session, nothing is timed."
+                + ("" if METRICS_CONTROLS else " Start the server with LAB_METRICS=1 to record.")
+            )
+            return
+        st.caption("Recording for every session on this server.")
+
+        snap = snapshot()
+        if snap["stages"]:
+            st.dataframe(
+                [
+                    {
+                        "stage": stage,
+                        "calls": stats["count"],
+                        "errors": stats["errors"],
+                        "avg ms": round(stats["avg_ms"], 1),
+                        "p50 ms": round(stats["p50_ms"], 1),
+                        "p95 ms": round(stats["p95_ms"], 1),
+                        "max ms": round(stats["max_ms"], 1),
+                    }
+                    for stage, stats in sorted(snap["stages"].items())
+                ],
+                hide_index=True,
+            )
+        for name, value in sorted(snap["counters"].items()):
+            st.write(f"{name}: {value}")
+
+        st.caption(f"Log: {METRICS_JSONL_PATH} · Prometheus: {METRICS_PROM_PATH}")
+        if METRICS_CONTROLS and st.button("Reset metrics"):
+            reset()
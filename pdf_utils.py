@@ -0,0 +1,394 @@
+import contextlib
+import hashlib
+import json
+import multiprocessing
+import os
+import queue
+import sys
+import tempfile
+import threading
+import time
+import types
+import weakref
+from collections import namedtuple
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from caching import LRUCache
+from metrics import record, timed
+from uploads import MAX_PDF_PAGES, check_page_count, spool_upload, upload_digest
+
+# extracted text is cached by the sha256 of the pdf bytes:
+# in-memory LRU first, then one json file per document on disk.
+# fitz is imported inside the functions that parse, cache hits never load it
+CACHE_DIR = os.path.join(".cache", "pdf_text")
+MEMORY_CACHE_MAX_CHARS = 64 * 1024 * 1024
+DISK_CACHE_MAX_BYTES = 512 * 1024 * 1024
+
+_memory_cache = LRUCache(
+    MEMORY_CACHE_MAX_CHARS, sizeof=lambda pages: sum(len(p) for p in pages)
+)
+
+# big documents are split into page ranges and parsed in a process pool,
+# small ones stay sequential so they don't pay for the pool
+PARALLEL_PAGE_THRESHOLD = 64
+PARALLEL_WORKERS = max(1, min(8, (os.cpu_count() or 1)))
+
+_pool = None
+_pool_lock = threading.Lock()
+
+# the streaming path parses on a background thread and keeps at most
+# PREFETCH_PAGES pages waiting for the consumer
+PREFETCH_PAGES = 4
+
+# number is 1-based, total is the page count of the document
+Page = namedtuple("Page", ["number", "total", "text"])
+
+# one lock per document so concurrent sessions don't parse the same pdf twice
+_parse_locks = weakref.WeakValueDictionary()
+_parse_locks_guard = threading.Lock()
+
+# uploads not in the cache are parsed from a spooled temp file; at most
+# this many at once, so a burst of large uploads queues instead of
+# holding several documents' worth of parser memory at the same time
+MAX_CONCURRENT_PARSES = 2
+_parse_slots = threading.BoundedSemaphore(MAX_CONCURRENT_PARSES)
+
+
+def _lock_for(key):
+    with _parse_locks_guard:
+        lock = _parse_locks.get(key)
+        if lock is None:
+            lock = threading.Lock()
+            _parse_locks[key] = lock
+        return lock
+
+
+def _disk_path(key):
+    return os.path.join(CACHE_DIR, key + ".json")
+
+
+def _disk_get(key):
+    path = _disk_path(key)
+    try:
+        with open(path, encoding="utf-8") as f:
+            pages = json.load(f)
+    except (OSError, ValueError):
+        return None
+
+    # bump mtime so eviction drops the least recently used files first
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+    return pages
+
+
+def _disk_put(key, pages):
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=CACHE_DIR, suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(pages, f)
+        os.replace(tmp_path, _disk_path(key))
+    except OSError:
+        return
+    _evict_disk()
+
+
+def _evict_disk():
+    entries = []
+    total = 0
+    for name in os.listdir(CACHE_DIR):
+        if not name.endswith(".json"):
+            continue
+        path = os.path.join(CACHE_DIR, name)
+        try:
+            st = os.stat(path)
+        except OSError:
+            continue
+        entries.append((st.st_mtime, st.st_size, path))
+        total += st.st_size
+
+    if total <= DISK_CACHE_MAX_BYTES:
+        return
+
+    entries.sort()
+    for _, size, path in entries:
+        try:
+            os.remove(path)
+        except OSError:
+            continue
+        total -= size
+        if total <= DISK_CACHE_MAX_BYTES:
+            break
+
+
+def _get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # spawn, not fork: the streamlit server process is multi-threaded
+            _pool = ProcessPoolExecutor(
+                max_workers=PARALLEL_WORKERS,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return _pool
+
+
+# streamlit runs every page script as the __main__ module, and spawn
+# re-imports __main__ in each new worker, i.e. would re-run the page there.
+# workers are started inside submit(), so the page is hidden for that call
+_worker_main = types.ModuleType("__main__")
+
+
+def _submit(fn, *args):
+    pool = _get_pool()
+    with _pool_lock:
+        main = sys.modules["__main__"]
+        sys.modules["__main__"] = _worker_main
+        try:
+            return pool.submit(fn, *args)
+        finally:
+            sys.modules["__main__"] = main
+
+
+def _page_ranges(page_count, parts):
+    step = -(-page_count // parts)
+    return [(start, min(start + step, page_count)) for start in range(0, page_count, step)]
+
+
+def _extract_page_range(path, start, stop):
+    import fitz  # PyMuPDF
+
+    # runs in a worker process, each worker opens the spooled file itself
+    # (only the path is pickled, not the document)
+    with fitz.open(path, filetype="pdf") as doc:
+        return [doc[i].get_text() for i in range(start, stop)]
+
+
+def _stream_pages(path, prefetch=PREFETCH_PAGES, max_pages=None, slots=None, stage=None):
+    buffer = queue.Queue(maxsize=max(1, prefetch))
+    stop = threading.Event()
+    done = object()
+    # slots (e.g. _parse_slots) is only held while fitz is working, never
+    # while the producer waits for the consumer to make room in the buffer
+    parsing = slots or contextlib.nullcontext()
+    # with a stage, the time spent parsing (not waiting on the consumer) is
+    # recorded once the producer finishes
+    fields = {"pages": 0, "streamed": True}
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                buffer.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def produce():
+        import fitz  # PyMuPDF
+
+        parse_s = 0.0
+        try:
+            started = time.perf_counter()
+            with parsing:
+                doc = fitz.open(path, filetype="pdf")
+            parse_s += time.perf_counter() - started
+            with doc:
+                total = doc.page_count
+                check_page_count(total, max_pages)
+                for i in range(total):
+                    if stop.is_set():
+                        return
+                    started = time.perf_counter()
+                    with parsing:
+                        text = doc[i].get_text()
+                    parse_s += time.perf_counter() - started
+                    fields["pages"] += 1
+                    put(Page(i + 1, total, text))
+        except Exception as e:
+            fields["error"] = type(e).__name__
+            put(e)
+        finally:
+            put(done)
+            if stage:
+                record(stage, parse_s, **fields)
+
+    threading.Thread(target=produce, daemon=True).start()
+
+    try:
+        while True:
+            item = buffer.get()
+            if item is done:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        # consumer stopped early (or finished): let the producer exit
+        stop.set()
+
+
+def _extract_file(path):
+    import fitz  # PyMuPDF
+
+    # runs in a worker process
+    with fitz.open(path) as doc:
+        return [page.get_text() for page in doc]
+
+
+def _parse_pages(path, parallel=None, on_progress=None, max_pages=None):
+    import fitz  # PyMuPDF
+
+    with fitz.open(path, filetype="pdf") as doc:
+        page_count = doc.page_count
+    check_page_count(page_count, max_pages)
+    if parallel is None:
+        parallel = page_count >= PARALLEL_PAGE_THRESHOLD and PARALLEL_WORKERS > 1
+
+    pages = []
+    if not parallel:
+        for page in _stream_pages(path):
+            pages.append(page.text)
+            if on_progress:
+                on_progress(page.number, page.total)
+        return pages
+
+    ranges = _page_ranges(page_count, PARALLEL_WORKERS)
+    futures = [
+        _submit(_extract_page_range, path, start, stop)
+        for start, stop in ranges
+    ]
+
+    # ranges are collected in submission order, so output matches the sequential path
+    for future in futures:
+        pages.extend(future.result())
+        if on_progress:
+            on_progress(len(pages), page_count)
+    return pages
+
+
+def _cached_pages(key):
+    pages = _memory_cache.get(key)
+    if pages is None:
+        pages = _disk_get(key)
+        if pages is not None:
+            _memory_cache.put(key, pages)
+    return pages
+
+
+def extract_pages(uploaded_pdf, parallel=None, on_progress=None) -> list:
+    """Return the text of every page, parsing each distinct pdf only once.
+
+    parallel=None picks the process pool by page count, True/False forces it.
+    on_progress(done, total) is called while pages are being parsed.
+    Raises uploads.UploadTooLarge over the size or page limit.
+    """
+    key = upload_digest(uploaded_pdf)
+
+    pages = _memory_cache.get(key)
+    if pages is not None:
+        return pages
+
+    with _lock_for(key):
+        pages = _cached_pages(key)
+        if pages is None:
+            with _parse_slots, spool_upload(uploaded_pdf, suffix=".pdf") as path:
+                pages = _parse_pages(
+                    path, parallel=parallel, on_progress=on_progress, max_pages=MAX_PDF_PAGES
+                )
+            _disk_put(key, pages)
+            _memory_cache.put(key, pages)
+
+    return pages
+
+
+def extract_pdf_files(paths, max_pending=PARALLEL_WORKERS):
+    """Yield (path, pages) for many pdf files on disk.
+
+    Cached files come back right away, the rest are parsed one file per
+    task in the process pool and yielded in completion order. At most
+    max_pending files are being parsed or waiting to be picked up, which
+    bounds the text held in memory.
+    """
+    pending = {}
+
+    def finished(futures):
+        for future in futures:
+            path, key = pending.pop(future)
+            pages = future.result()
+            _disk_put(key, pages)
+            _memory_cache.put(key, pages)
+            yield path, pages
+
+    for path in paths:
+        with open(path, "rb") as f:
+            key = hashlib.file_digest(f, "sha256").hexdigest()
+
+        pages = _cached_pages(key)
+        if pages is not None:
+            yield path, pages
+            continue
+
+        if len(pending) >= max_pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            yield from finished(done)
+        pending[_submit(_extract_file, path)] = (path, key)
+
+    while pending:
+        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+        yield from finished(done)
+
+
+def _replay_pages(pages):
+    for i, text in enumerate(pages):
+        yield Page(i + 1, len(pages), text)
+
+
+def _report_progress(pages, on_progress):
+    for page in pages:
+        if on_progress:
+            on_progress(page.number, page.total)
+        yield page
+
+
+def iter_pdf_pages(uploaded_pdf, prefetch=PREFETCH_PAGES, on_progress=None):
+    """Yield Page(number, total, text) lazily, one page at a time.
+
+    Parsing runs ahead of the consumer by at most `prefetch` pages, so
+    chunking/summarizing can start on page 1 while later pages are still
+    being parsed. Already cached documents are replayed from the cache.
+    Streamed pages are not added to the cache, use extract_pages() when
+    the whole document is needed anyway. on_progress(done, total) is
+    called as pages are handed out.
+    """
+    started = time.perf_counter()
+    key = upload_digest(uploaded_pdf)
+
+    pages = _cached_pages(key)
+    if pages is not None:
+        record("extract_pdf", time.perf_counter() - started, pages=len(pages), streamed=True)
+        yield from _report_progress(_replay_pages(pages), on_progress)
+        return
+
+    # the parse slot is taken per page by the producer, a consumer that
+    # pauses between pages (e.g. waiting on the llm) doesn't block other parses
+    with spool_upload(uploaded_pdf, suffix=".pdf") as path:
+        pages = _stream_pages(
+            path, prefetch=prefetch, max_pages=MAX_PDF_PAGES, slots=_parse_slots, stage="extract_pdf"
+        )
+        yield from _report_progress(pages, on_progress)
+
+
+def iter_pdf_files_pages(paths, max_pending=PARALLEL_WORKERS):
+    """extract_pdf_files() with each file's pages as Page tuples."""
+    for path, pages in extract_pdf_files(paths, max_pending):
+        yield path, _replay_pages(pages)
+
+
+def extract_text_from_pdf(uploaded_pdf, parallel=None, on_progress=None) -> str:
+    """Extract all text from an uploaded PDF file using PyMuPDF."""
+    with timed("extract_pdf") as fields:
+        pages = extract_pages(uploaded_pdf, parallel=parallel, on_progress=on_progress)
+        fields["pages"] = len(pages)
+        return "".join(pages)
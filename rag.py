@@ -0,0 +1,643 @@
+import sys
+
+try:
+    import pysqlite3
+    sys.modules["sqlite3"] = pysqlite3
+except Exception:
+    pass
+
+import hashlib
+import json
+import os
+import pickle
+import random
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from bm25 import BM25Index, reciprocal_rank_fusion
+from caching import LRUCache
+from chunking import chunk_pages, format_source
+from embed_cache import CachedEmbeddingFunction
+import metrics
+from pdf_utils import iter_pdf_files_pages
+
+# lab 4 - RAG ingestion, kept out of lab4.py so it can run without a page
+PDF_FOLDER = "lab4_pdfs"
+PERSIST_PATH = "./chroma_lab4"
+COLLECTION_NAME = "Lab4Chunks"
+EMBEDDING_MODEL = "text-embedding-3-small"
+
+# one embedding request holds at most this many tokens / inputs
+# (the api allows 300k tokens and 2048 inputs per request)
+EMBED_BATCH_MAX_TOKENS = 100_000
+EMBED_BATCH_MAX_ITEMS = 256
+EMBED_CONCURRENCY = 4
+EMBED_MAX_RETRIES = 5
+
+# chunks per collection.upsert / delete call
+CHROMA_WRITE_BATCH = 4000
+
+# filename -> size, mtime, sha256 and chunk ids of every indexed pdf,
+# stored next to the chroma files so both are wiped together
+MANIFEST_NAME = "lab4_manifest.json"
+
+# lexical index kept in step with the collection during sync
+BM25_NAME = "lab4_bm25.pkl"
+
+# hybrid retrieval: both retrievers return this many candidates per
+# requested result, then reciprocal-rank fusion picks the final order
+CANDIDATES_PER_RESULT = 4
+VECTOR_WEIGHT = 1.0
+LEXICAL_WEIGHT = 1.0
+RRF_K = 60
+
+# repeated questions skip embedding + search; entries also go stale after
+# the ttl and are dropped whenever a sync changes the collection
+RETRIEVAL_CACHE_ENTRIES = 1024
+RETRIEVAL_CACHE_TTL = 15 * 60
+
+
+def normalize_question(text):
+    return " ".join(text.lower().split()).rstrip("?!. ")
+
+
+def _openai_api_key():
+    key = os.environ.get("OPENAI_API_KEY")
+    if key:
+        return key
+
+    import streamlit as st
+    return st.secrets["OPENAI_API_KEY"]
+
+
+def default_embedding_function():
+    from chromadb.utils import embedding_functions
+
+    return embedding_functions.OpenAIEmbeddingFunction(
+        api_key=_openai_api_key(),
+        model_name=EMBEDDING_MODEL,
+    )
+
+
+_embedder = None
+_embedder_lock = threading.Lock()
+
+
+def get_embedder():
+    """Process-wide cached OpenAI embedder shared by ingestion and queries."""
+    global _embedder
+    with _embedder_lock:
+        if _embedder is None:
+            _embedder = CachedEmbeddingFunction(default_embedding_function(), EMBEDDING_MODEL)
+        return _embedder
+
+
+def _embed_with_retry(embedding_function, texts):
+    for attempt in range(EMBED_MAX_RETRIES):
+        try:
+            return list(embedding_function(texts))
+        except Exception:
+            if attempt == EMBED_MAX_RETRIES - 1:
+                raise
+            # exponential backoff with jitter (rate limits, timeouts)
+            time.sleep(min(30, 2 ** attempt) + random.random())
+
+
+def _write_chunks(collection, chunks, vectors, bm25=None):
+    for start in range(0, len(chunks), CHROMA_WRITE_BATCH):
+        block = chunks[start:start + CHROMA_WRITE_BATCH]
+        collection.upsert(
+            ids=[c["id"] for c in block],
+            documents=[c["text"] for c in block],
+            metadatas=[c["metadata"] for c in block],
+            embeddings=vectors[start:start + CHROMA_WRITE_BATCH],
+        )
+        if bm25 is not None:
+            for c in block:
+                bm25.add(c["id"], c["text"])
+
+
+def ingest_pdfs(collection, paths, embedding_function, bm25=None):
+    """Extract, chunk, embed and store many pdfs in bulk.
+
+    Files are parsed in parallel (pdf_utils.iter_pdf_files_pages, one file
+    per task in the process pool, cached text comes back right away) and
+    each one is chunked as soon as it is done. Chunks are grouped into
+    batches bounded by EMBED_BATCH_MAX_TOKENS and EMBED_BATCH_MAX_ITEMS,
+    batches are embedded EMBED_CONCURRENCY at a time while parsing goes
+    on, and written to chroma in large upserts. Memory holds the text of
+    at most a few files in flight, the queued batches and one write
+    block. embedding_function is any chroma-style callable (list of texts
+    -> list of vectors), so a local stub works for offline runs. Chunks
+    are also added to the bm25 index when one is given. Returns
+    {source filename: [chunk ids]}.
+    """
+    futures = {}
+    chunk_ids = {os.path.basename(path): [] for path in paths}
+    pending_chunks = []
+    pending_vectors = []
+
+    def flush():
+        nonlocal pending_chunks, pending_vectors
+        if pending_chunks:
+            _write_chunks(collection, pending_chunks, pending_vectors, bm25)
+            for c in pending_chunks:
+                chunk_ids[c["metadata"]["source"]].append(c["id"])
+        pending_chunks, pending_vectors = [], []
+
+    def collect(done_futures):
+        for future in done_futures:
+            batch = futures.pop(future)
+            pending_chunks.extend(batch)
+            pending_vectors.extend(future.result())
+        if len(pending_chunks) >= CHROMA_WRITE_BATCH:
+            flush()
+
+    with ThreadPoolExecutor(max_workers=EMBED_CONCURRENCY) as pool:
+        batch, batch_tokens = [], 0
+
+        def submit(batch):
+            texts = [c["text"] for c in batch]
+            futures[pool.submit(_embed_with_retry, embedding_function, texts)] = batch
+            # keep the number of queued batches bounded
+            if len(futures) >= EMBED_CONCURRENCY * 2:
+                collect([next(as_completed(futures))])
+
+        for path, pages in iter_pdf_files_pages(paths):
+            source = os.path.basename(path)
+
+            for chunk in chunk_pages(pages, source):
+                if batch and (
+                    batch_tokens + chunk["tokens"] > EMBED_BATCH_MAX_TOKENS
+                    or len(batch) >= EMBED_BATCH_MAX_ITEMS
+                ):
+                    submit(batch)
+                    batch, batch_tokens = [], 0
+                batch.append(chunk)
+                batch_tokens += chunk["tokens"]
+
+        if batch:
+            submit(batch)
+
+        collect(list(as_completed(futures)))
+
+    flush()
+    return chunk_ids
+
+
+def _file_sha256(path):
+    with open(path, "rb") as f:
+        return hashlib.file_digest(f, "sha256").hexdigest()
+
+
+def _load_manifest(path):
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _save_manifest(path, manifest):
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or ".", suffix=".tmp")
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        json.dump(manifest, f)
+    os.replace(tmp_path, path)
+
+
+def _pdf_versions(manifest):
+    # the content hash of every indexed pdf, saved with the bm25 index
+    return {filename: entry["sha256"] for filename, entry in manifest.items()}
+
+
+def _delete_ids(collection, ids, bm25=None):
+    for start in range(0, len(ids), CHROMA_WRITE_BATCH):
+        collection.delete(ids=ids[start:start + CHROMA_WRITE_BATCH])
+    if bm25 is not None:
+        for chunk_id in ids:
+            bm25.remove(chunk_id)
+
+
+def sync_pdf_folder(collection, pdf_folder, embedding_function, manifest_path, bm25=None):
+    """Bring the collection in line with the pdfs in pdf_folder.
+
+    Unchanged files are recognised from size + mtime alone (no hashing,
+    no chroma reads). Files whose stat changed are hashed; if the content
+    really changed, or the file is new, its chunks are (re)ingested. Chunks
+    of changed and deleted files are removed. Returns counts per outcome.
+    """
+    manifest = _load_manifest(manifest_path)
+    stats = {"added": 0, "changed": 0, "removed": 0, "unchanged": 0}
+
+    seen = set()
+    to_ingest = {}
+    stale_ids = []
+    touched = False
+
+    for filename in sorted(os.listdir(pdf_folder)):
+        if not filename.lower().endswith(".pdf"):
+            continue
+
+        path = os.path.join(pdf_folder, filename)
+        file_stat = os.stat(path)
+        seen.add(filename)
+
+        entry = manifest.get(filename)
+        if entry and entry["size"] == file_stat.st_size and entry["mtime"] == file_stat.st_mtime_ns:
+            stats["unchanged"] += 1
+            continue
+
+        digest = _file_sha256(path)
+        if entry and entry["sha256"] == digest:
+            # touched but same content
+            entry["size"], entry["mtime"] = file_stat.st_size, file_stat.st_mtime_ns
+            touched = True
+            stats["unchanged"] += 1
+            continue
+
+        if entry:
+            stale_ids.extend(entry["ids"])
+            del manifest[filename]
+            stats["changed"] += 1
+        else:
+            stats["added"] += 1
+
+        to_ingest[path] = {
+            "size": file_stat.st_size,
+            "mtime": file_stat.st_mtime_ns,
+            "sha256": digest,
+        }
+
+    for filename in [f for f in manifest if f not in seen]:
+        stale_ids.extend(manifest.pop(filename)["ids"])
+        stats["removed"] += 1
+
+    if stale_ids:
+        _delete_ids(collection, stale_ids, bm25)
+    if stale_ids or touched:
+        _save_manifest(manifest_path, manifest)
+
+    if to_ingest:
+        chunk_ids = ingest_pdfs(collection, list(to_ingest), embedding_function, bm25)
+        for path, entry in to_ingest.items():
+            filename = os.path.basename(path)
+            entry["ids"] = chunk_ids[filename]
+            manifest[filename] = entry
+        _save_manifest(manifest_path, manifest)
+
+    if bm25 is not None:
+        bm25.meta["pdfs"] = _pdf_versions(manifest)
+    return stats
+
+
+def open_lab4_collection(embedding_function=None, persist_path=PERSIST_PATH):
+    import chromadb  # heavy, only loaded once lab 4 needs the store
+
+    client = chromadb.PersistentClient(path=persist_path)
+
+    # embeddings are computed here (through the cache) and passed to chroma
+    # explicitly, the collection keeps the plain openai function as its config.
+    # custom functions (stubs, benchmarks) aren't chroma embedding functions,
+    # so those collections get no function at all
+    embed_fn = embedding_function or get_embedder()
+    collection_fn = None if embedding_function else get_embedder().embedding_function
+
+    # one entry per token chunk (the old Lab4Collection held whole syllabi)
+    collection = client.get_or_create_collection(
+        name=COLLECTION_NAME,
+        embedding_function=collection_fn,
+    )
+    return collection, embed_fn
+
+
+def create_lab4_vectordb(pdf_folder: str, embedding_function=None, persist_path=PERSIST_PATH):
+    # synced through Lab4Store so the bm25 index on disk follows the collection.
+    # the default folder and path go through the shared store, so its bm25
+    # index and retrieval cache see the sync too
+    default_store = (
+        embedding_function is None
+        and os.path.normpath(pdf_folder) == os.path.normpath(PDF_FOLDER)
+        and os.path.normpath(persist_path) == os.path.normpath(PERSIST_PATH)
+    )
+    store = get_lab4_store() if default_store else Lab4Store(pdf_folder, persist_path, embedding_function)
+    store.refresh()
+    return store.collection
+
+
+def query_collection(collection, query_text, n_results=3, include=("documents", "metadatas"),
+                     embedding_function=None):
+    # embed the query through the same cache as ingestion
+    embed_fn = embedding_function or get_embedder()
+    return collection.query(
+        query_embeddings=embed_fn([query_text]),
+        n_results=n_results,
+        include=list(include),
+    )
+
+
+class Lab4Store:
+    """One chroma collection per process, shared by every session.
+
+    Queries go straight to the collection (chroma reads are thread-safe),
+    refresh() re-syncs the pdf folder under a lock and bumps `version`
+    whenever the collection content changed, here or through another
+    store on the same persist_path. A bm25 index over the same chunks is
+    loaded from disk (or rebuilt from chroma) and updated by every sync.
+    """
+
+    def __init__(self, pdf_folder=PDF_FOLDER, persist_path=PERSIST_PATH, embedding_function=None):
+        self.pdf_folder = pdf_folder
+        self.persist_path = persist_path
+        self.manifest_path = os.path.join(persist_path, MANIFEST_NAME)
+        self.bm25_path = os.path.join(persist_path, BM25_NAME)
+        self.collection, self.embedding_function = open_lab4_collection(
+            embedding_function, persist_path
+        )
+        self.bm25 = self._load_bm25()
+        self.version = 0
+        self.last_sync = None
+        self._lock = threading.Lock()
+
+        self.search_cache = LRUCache(
+            RETRIEVAL_CACHE_ENTRIES, sizeof=lambda hits: 1, ttl=RETRIEVAL_CACHE_TTL
+        )
+        self._latency_lock = threading.Lock()
+        self._latency = {"hit": [0, 0.0], "miss": [0, 0.0]}
+
+    def _load_bm25(self):
+        manifest = _load_manifest(self.manifest_path)
+        indexed_ids = {chunk_id for entry in manifest.values() for chunk_id in entry["ids"]}
+        try:
+            bm25 = BM25Index.load(self.bm25_path)
+        except (OSError, EOFError, ValueError, KeyError, pickle.UnpicklingError):
+            bm25 = None
+
+        # chunk ids are "<file>#<n>", a pdf whose new content splits into as
+        # many chunks keeps its ids, so the pdf hashes have to match as well
+        if (
+            bm25 is not None
+            and bm25.meta.get("pdfs") == _pdf_versions(manifest)
+            and bm25.doc_numbers.keys() == indexed_ids
+        ):
+            return bm25
+
+        # missing or out of step with the manifest: rebuild from chroma
+        bm25 = BM25Index()
+        offset = 0
+        while True:
+            page = self.collection.get(
+                include=["documents"], limit=CHROMA_WRITE_BATCH, offset=offset
+            )
+            for chunk_id, text in zip(page["ids"], page["documents"]):
+                bm25.add(chunk_id, text)
+            if len(page["ids"]) < CHROMA_WRITE_BATCH:
+                break
+            offset += CHROMA_WRITE_BATCH
+        bm25.meta["pdfs"] = _pdf_versions(manifest)
+        if len(bm25):
+            bm25.save(self.bm25_path)
+        return bm25
+
+    def refresh(self):
+        with self._lock:
+            # another store or process (batch_qa.py) may have synced the same
+            # persist_path since our bm25 index was loaded
+            if self.bm25.meta.get("pdfs") != _pdf_versions(_load_manifest(self.manifest_path)):
+                self.bm25 = self._load_bm25()
+                self.version += 1
+                self.search_cache.clear()
+
+            stats = sync_pdf_folder(
+                self.collection,
+                self.pdf_folder,
+                self.embedding_function,
+                manifest_path=self.manifest_path,
+                bm25=self.bm25,
+            )
+            if stats["added"] or stats["changed"] or stats["removed"]:
+                self.bm25.save(self.bm25_path)
+                self.version += 1
+                self.search_cache.clear()
+            self.last_sync = stats
+            return stats
+
+    def query(self, query_text, n_results=3, include=("documents", "metadatas")):
+        return query_collection(
+            self.collection,
+            query_text,
+            n_results=n_results,
+            include=include,
+            embedding_function=self.embedding_function,
+        )
+
+    def search(self, query_text, n_results=3, vector_weight=VECTOR_WEIGHT,
+               lexical_weight=LEXICAL_WEIGHT):
+        """Hybrid search: dense + bm25 candidates fused with reciprocal-rank fusion.
+
+        Returns a list of {"id", "text", "metadata", "score"} dicts, best
+        first, score being the fused rrf score.
+        Results are cached per (normalized question, n_results, weights,
+        collection version).
+        """
+        start = time.perf_counter()
+        key = (
+            normalize_question(query_text),
+            n_results,
+            vector_weight,
+            lexical_weight,
+            self.version,
+        )
+
+        hits = self.search_cache.get(key)
+        outcome = "hit"
+        if hits is None:
+            outcome = "miss"
+            hits = self._search(query_text, n_results, vector_weight, lexical_weight)
+            self.search_cache.put(key, hits)
+
+        elapsed = time.perf_counter() - start
+        with self._latency_lock:
+            self._latency[outcome][0] += 1
+            self._latency[outcome][1] += elapsed
+        metrics.record("retrieve", elapsed, cache=outcome, n_results=n_results)
+        return hits
+
+    def cache_stats(self):
+        stats = self.search_cache.stats()
+        with self._latency_lock:
+            for outcome, (count, total) in self._latency.items():
+                stats[f"avg_{outcome}_ms"] = 1000 * total / count if count else 0.0
+        stats["version"] = self.version
+        return stats
+
+    def search_many(self, query_texts, n_results=3, vector_weight=VECTOR_WEIGHT,
+                    lexical_weight=LEXICAL_WEIGHT):
+        """search() for a batch of questions, results in the same order.
+
+        Questions not in the retrieval cache are embedded in one call and
+        sent to chroma as a single multi-vector query, then fused with
+        bm25 one by one.
+        """
+        start = time.perf_counter()
+        keys = [
+            (normalize_question(q), n_results, vector_weight, lexical_weight, self.version)
+            for q in query_texts
+        ]
+        results = [self.search_cache.get(key) for key in keys]
+        missing = [i for i, hits in enumerate(results) if hits is None]
+        if not missing:
+            metrics.record(
+                "retrieve_batch", time.perf_counter() - start,
+                questions=len(query_texts), misses=0, n_results=n_results,
+            )
+            return results
+
+        depth = max(n_results * CANDIDATES_PER_RESULT, 10)
+        vectors = self.embedding_function([query_texts[i] for i in missing])
+        dense = self.collection.query(
+            query_embeddings=vectors,
+            n_results=depth,
+            include=["documents", "metadatas"],
+        )
+        for row, i in enumerate(missing):
+            results[i] = self._fuse(
+                query_texts[i],
+                dense["ids"][row], dense["documents"][row], dense["metadatas"][row],
+                n_results, vector_weight, lexical_weight,
+            )
+            self.search_cache.put(keys[i], results[i])
+
+        # one event per batch, per-question latency is elapsed / questions
+        metrics.record(
+            "retrieve_batch", time.perf_counter() - start,
+            questions=len(query_texts), misses=len(missing), n_results=n_results,
+        )
+        return results
+
+    def _search(self, query_text, n_results, vector_weight, lexical_weight):
+        depth = max(n_results * CANDIDATES_PER_RESULT, 10)
+
+        dense = self.query(query_text, n_results=depth, include=["documents", "metadatas"])
+        return self._fuse(
+            query_text,
+            dense["ids"][0], dense["documents"][0], dense["metadatas"][0],
+            n_results, vector_weight, lexical_weight,
+        )
+
+    def _fuse(self, query_text, dense_ids, dense_texts, dense_metadatas, n_results,
+              vector_weight, lexical_weight):
+        depth = max(n_results * CANDIDATES_PER_RESULT, 10)
+        hits = {
+            chunk_id: {"id": chunk_id, "text": text, "metadata": metadata}
+            for chunk_id, text, metadata in zip(dense_ids, dense_texts, dense_metadatas)
+        }
+        dense_ranking = list(dense_ids)
+        lexical_ranking = [chunk_id for chunk_id, _ in self.bm25.search(query_text, k=depth)]
+
+        fused = reciprocal_rank_fusion(
+            [dense_ranking, lexical_ranking],
+            weights=[vector_weight, lexical_weight],
+            k=RRF_K,
+        )[:n_results]
+
+        # lexical-only hits still need their text and metadata
+        missing = [chunk_id for chunk_id, _ in fused if chunk_id not in hits]
+        if missing:
+            extra = self.collection.get(ids=missing, include=["documents", "metadatas"])
+            for chunk_id, text, metadata in zip(extra["ids"], extra["documents"], extra["metadatas"]):
+                hits[chunk_id] = {"id": chunk_id, "text": text, "metadata": metadata}
+
+        return [
+            {**hits[chunk_id], "score": score}
+            for chunk_id, score in fused if chunk_id in hits
+        ]
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_lab4_store():
+    """Return the process-wide Lab4Store, syncing it on first use."""
+    global _store
+    with _store_lock:
+        if _store is None:
+            store = Lab4Store()
+            store.refresh()
+            _store = store
+        return _store
+
+
+# the store is built on a background thread when the app process starts
+# (streamlit_app.py), so the first lab 4 visitor doesn't wait for the sync
+_warmup_thread = None
+_warmup_error = None
+_warmup_lock = threading.Lock()
+
+
+def _warm_up():
+    global _warmup_error
+    try:
+        get_lab4_store()
+    except Exception as e:
+        _warmup_error = e
+
+
+def start_lab4_warmup(retry=False):
+    """Start building the Lab4 store in the background. Safe to call on every rerun.
+
+    Only the first call starts it; after a failure it is started again
+    only with retry=True (the "Try again" button), so a persistent error
+    doesn't re-open and re-sync the store on every rerun.
+    """
+    global _warmup_thread, _warmup_error
+    with _warmup_lock:
+        if _store is not None or (_warmup_thread is not None and _warmup_thread.is_alive()):
+            return
+        if _warmup_thread is not None and not (retry and _warmup_error is not None):
+            return
+        # first call, or an explicit retry after a failed warm-up
+        _warmup_error = None
+        _warmup_thread = threading.Thread(target=_warm_up, name="lab4-warmup", daemon=True)
+        _warmup_thread.start()
+
+
+def lab4_store_state():
+    """"ready", "warming", "error" (see lab4_store_error()) or "cold"."""
+    if _store is not None:
+        return "ready"
+    if _warmup_error is not None:
+        return "error"
+    if _warmup_thread is not None:
+        return "warming"
+    return "cold"
+
+
+def lab4_store_error():
+    return _warmup_error
+
+
+# fixed instructions first (same bytes every question), then context + question
+RAG_INSTRUCTIONS = (
+    "You are a course information chatbot.\n"
+    "Use the RAG context below to answer.\n"
+    "Be clear when you are using knowledge from the RAG context.\n"
+    "If the answer is not in the RAG context, say you cannot find it."
+)
+
+
+def build_rag_messages(context, question):
+    return [
+        {"role": "system", "content": RAG_INSTRUCTIONS},
+        {"role": "user", "content": f"RAG CONTEXT:\n{context}\n\nQUESTION:\n{question}\n"},
+    ]
+
+
+def retrieve_top_docs(question: str, n_results: int = 3, store=None):
+    store = store or get_lab4_store()
+    hits = store.search(question, n_results=n_results)
+    docs = [hit["text"] for hit in hits]
+    sources = [format_source(hit["metadata"]) for hit in hits]
+    return docs, sources
@@ -1,5 +1,12 @@
 import streamlit as st
 
+from metrics import metrics_panel
+from rag import start_lab4_warmup
+
+# runs on every rerun, only the first call in the process starts the thread
+# (a failed warm-up is retried from the lab 4 page, not here)
+start_lab4_warmup()
+
 lab1_page = st.Page("lab1.py", title="lab 1")
 lab2_page = st.Page("lab2.py", title="lab 2")
 lab3_page = st.Page("lab3.py", title="lab 3")
@@ -8,4 +15,6 @@ lab5_page = st.Page("lab5.py", title="lab 5")
 
 pg = st.navigation([lab5_page,lab4_page, lab3_page, lab2_page, lab1_page])
 
-pg.run()
\ No newline at end of file
+metrics_panel()
+
+pg.run()
@@ -0,0 +1,143 @@
+import asyncio
+import itertools
+
+from chunking import count_tokens, get_encoding
+from llm import run_coroutine, submit_coroutine, text_content
+
+# lab 2 - map-reduce summaries for documents that don't fit in one prompt
+SINGLE_PASS_TOKENS = 12_000
+MAP_CHUNK_TOKENS = 6_000
+MAP_MAX_TOKENS = 600
+REDUCE_GROUP_TOKENS = 8_000
+MAP_CONCURRENCY = 4
+FINAL_MAX_TOKENS = 2_048
+
+MAP_PROMPT = (
+    "You are summarizing one part of a longer document. "
+    "Write concise notes that keep the key facts, names, numbers and dates. "
+    "Do not add an introduction or a conclusion."
+)
+REDUCE_PROMPT = (
+    "Combine these consecutive notes from one document into a single set of concise notes. "
+    "Keep the key facts, names, numbers and dates, in document order."
+)
+
+
+def _token_chunks(texts, chunk_tokens=MAP_CHUNK_TOKENS):
+    # token windows over a stream of texts, yielded as soon
+    # as enough tokens have arrived (map stage only, windows are summarized
+    # separately so a character split across two of them doesn't matter)
+    encoding = get_encoding()
+    tokens = []
+    for text in texts:
+        tokens.extend(encoding.encode(text, disallowed_special=()))
+        while len(tokens) >= chunk_tokens:
+            yield encoding.decode(tokens[:chunk_tokens])
+            del tokens[:chunk_tokens]
+    if tokens:
+        yield encoding.decode(tokens)
+
+
+def _group_by_tokens(notes, group_tokens):
+    groups, current, current_tokens = [], [], 0
+    for note in notes:
+        tokens = count_tokens(note)
+        if current and current_tokens + tokens > group_tokens:
+            groups.append(current)
+            current, current_tokens = [], 0
+        current.append(note)
+        current_tokens += tokens
+    if current:
+        groups.append(current)
+    return groups
+
+
+async def _complete(chat, semaphore, system_prompt, text):
+    async with semaphore:
+        return await chat.acomplete(
+            [
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": text},
+            ],
+            max_tokens=MAP_MAX_TOKENS,
+        )
+
+
+async def _reduce(chat, notes, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+
+    # reduce hierarchically until everything fits in the final prompt
+    while count_tokens("\n\n".join(notes)) > REDUCE_GROUP_TOKENS:
+        groups = _group_by_tokens(notes, REDUCE_GROUP_TOKENS)
+        if len(groups) == len(notes):
+            # every note is too big to pair with another one, stop here
+            break
+        notes = await asyncio.gather(*(
+            _complete(chat, semaphore, REDUCE_PROMPT, "\n\n---\n\n".join(group))
+            for group in groups
+        ))
+
+    return list(notes)
+
+
+def summarize_pages(chat, pages, instructions, concurrency=MAP_CONCURRENCY):
+    """Yield the summary of a document given as an iterable of page texts.
+
+    Pages are consumed as they arrive (e.g. streamed by
+    pdf_utils.iter_pdf_pages). Documents of up to SINGLE_PASS_TOKENS are
+    summarized in one streamed call. For longer ones every
+    MAP_CHUNK_TOKENS window goes to the map stage as soon as it is
+    complete, so parsing and summarizing overlap; at most 2 * concurrency
+    windows are queued, which bounds the text held in memory. The notes
+    are reduced in groups until they fit, and only the final call, which
+    applies `instructions` (summary type and language), is streamed.
+    chat is an llm.OpenAIChat or llm.AnthropicChat.
+    """
+    pages = iter(pages)
+
+    # hold the first pages until the document is known to be too long
+    # for a single pass
+    head, head_tokens = [], 0
+    for text in pages:
+        head.append(text)
+        head_tokens += count_tokens(text)
+        if head_tokens > SINGLE_PASS_TOKENS:
+            break
+    else:
+        yield from chat.stream(
+            [{
+                "role": "user",
+                "content": text_content(f"{instructions}\n\nHere's a document:\n", *head),
+            }],
+            max_tokens=FINAL_MAX_TOKENS,
+        )
+        return
+
+    # map: one request per window, started while later pages are parsed
+    semaphore = asyncio.Semaphore(concurrency)
+    futures = []
+    for text in _token_chunks(itertools.chain(head, pages)):
+        if len(futures) >= 2 * concurrency:
+            # backpressure: let older windows finish before queueing more
+            futures[-2 * concurrency].result()
+        futures.append(submit_coroutine(_complete(chat, semaphore, MAP_PROMPT, text)))
+    notes = run_coroutine(_reduce(chat, [future.result() for future in futures], concurrency))
+
+    yield from chat.stream(
+        [
+            {
+                "role": "user",
+                "content": (
+                    f"{instructions}\n\n"
+                    "Here are notes covering the whole document, in order:\n"
+                    + "\n\n---\n\n".join(notes)
+                ),
+            }
+        ],
+        max_tokens=FINAL_MAX_TOKENS,
+    )
+
+
+def summarize_document(chat, document_text, instructions, concurrency=MAP_CONCURRENCY):
+    """summarize_pages() for a document that is already one string."""
+    yield from summarize_pages(chat, [document_text], instructions, concurrency)
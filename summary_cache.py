@@ -0,0 +1,53 @@
+import hashlib
+import os
+import re
+
+from caching import SqliteStore
+
+# finished summaries keyed by (pdf hash, summary type, language, model,
+# prompt version); bump PROMPT_VERSION when the summary prompt changes.
+# keyed by the pdf rather than its text, so a hit doesn't need to parse it
+SUMMARY_CACHE_PATH = os.path.join(".cache", "summaries.sqlite")
+SUMMARY_CACHE_MAX_ENTRIES = 5000
+PROMPT_VERSION = "2"
+
+_store = None
+
+
+def _get_store():
+    global _store
+    if _store is None:
+        _store = SqliteStore(SUMMARY_CACHE_PATH, SUMMARY_CACHE_MAX_ENTRIES)
+    return _store
+
+
+def summary_key(document_hash, summary_type, language, model):
+    parts = [document_hash, summary_type, language, model, PROMPT_VERSION]
+    return hashlib.sha256("\0".join(parts).encode("utf-8")).hexdigest()
+
+
+def _replay(text):
+    # same shape as a live stream, so st.write_stream renders it the same way
+    for piece in re.findall(r"\S+\s*|\s+", text):
+        yield piece
+
+
+def cached_summary_stream(key, make_stream):
+    """Yield a summary, from the cache when possible.
+
+    make_stream() is only called on a miss; its text is stored once the
+    stream has been consumed to the end.
+    """
+    cached = _get_store().get("summary", key)
+    if cached is not None:
+        yield from _replay(cached.decode("utf-8"))
+        return
+
+    parts = []
+    for text in make_stream():
+        parts.append(text)
+        yield text
+
+    summary = "".join(parts)
+    if summary:
+        _get_store().put("summary", key, summary.encode("utf-8"))
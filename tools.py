@@ -0,0 +1,139 @@
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+from metrics import record, timed
+
+# lab 5 - tool calling
+TOOL_TIMEOUT_SECONDS = 20
+MAX_TOOL_ROUNDS = 4
+
+_tool_pool = ThreadPoolExecutor(max_workers=16, thread_name_prefix="tool")
+
+
+class ToolRegistry:
+    """Tools the model may call, by name, with their schema and timeout."""
+
+    def __init__(self):
+        self._tools = {}
+
+    def register(self, schema, fn, timeout=TOOL_TIMEOUT_SECONDS):
+        # schema is an openai tool definition: {"type": "function", "function": {...}}
+        name = schema["function"]["name"]
+        self._tools[name] = {"schema": schema, "fn": fn, "timeout": timeout}
+
+    def schemas(self):
+        return [tool["schema"] for tool in self._tools.values()]
+
+    def run_calls(self, tool_calls):
+        """Run all tool calls of one round concurrently.
+
+        Returns one (content, trace) pair per call, in call order. content
+        is the json string sent back to the model; failures and timeouts
+        are reported to the model as {"error": ...} instead of raising.
+        """
+        started = {}
+        futures = []
+        for call in tool_calls:
+            name = call.function.name
+            tool = self._tools.get(name)
+            try:
+                args = json.loads(call.function.arguments or "{}")
+            except ValueError:
+                args = call.function.arguments
+
+            started[call.id] = time.perf_counter()
+            # bad calls are answered right away, they never reach the pool
+            if tool is None:
+                futures.append((call, args, None, {"error": f"unknown tool {name}"}))
+            elif not isinstance(args, dict):
+                futures.append((call, args, None, {"error": f"{name} arguments must be a json object"}))
+            else:
+                futures.append((call, args, tool, _tool_pool.submit(tool["fn"], **args)))
+
+        results = []
+        # pending is the future, or the error result of a call that wasn't run
+        for call, args, tool, pending in futures:
+            if tool is None:
+                result = pending
+            else:
+                # timeouts count from when the call was submitted
+                remaining = tool["timeout"] - (time.perf_counter() - started[call.id])
+                try:
+                    result = pending.result(timeout=max(0.0, remaining))
+                except FutureTimeoutError:
+                    result = {"error": f"{call.function.name} timed out after {tool['timeout']}s"}
+                except Exception as e:
+                    result = {"error": str(e)}
+
+            trace = {
+                "tool": call.function.name,
+                "arguments": args,
+                "seconds": round(time.perf_counter() - started[call.id], 3),
+                "error": result.get("error") if isinstance(result, dict) else None,
+            }
+            record(f"tool:{trace['tool']}", trace["seconds"], error=trace["error"])
+            results.append((json.dumps(result), trace))
+        return results
+
+
+def _create(client, **kwargs):
+    with timed("llm_complete", model=kwargs["model"]) as fields:
+        response = client.chat.completions.create(**kwargs)
+        usage = getattr(response, "usage", None)
+        if usage is not None:
+            fields["prompt_tokens"] = usage.prompt_tokens
+            fields["completion_tokens"] = usage.completion_tokens
+        return response
+
+
+def run_tool_loop(client, model, messages, registry, max_rounds=MAX_TOOL_ROUNDS):
+    """Chat with tools until the model answers without calling any.
+
+    Every round sends the conversation, runs all requested tool calls in
+    parallel and appends the assistant tool_calls message plus one "tool"
+    message per result. After max_rounds the model is asked to answer
+    without tools. Returns (answer, trace of tool calls).
+    """
+    messages = list(messages)
+    trace = []
+
+    for _ in range(max_rounds):
+        response = _create(
+            client,
+            model=model,
+            messages=messages,
+            tools=registry.schemas(),
+            tool_choice="auto",
+        )
+        msg = response.choices[0].message
+        tool_calls = getattr(msg, "tool_calls", None)
+        if not tool_calls:
+            return msg.content or "", trace
+
+        messages.append({
+            "role": "assistant",
+            "content": msg.content,
+            "tool_calls": [
+                {
+                    "id": call.id,
+                    "type": "function",
+                    "function": {"name": call.function.name, "arguments": call.function.arguments},
+                }
+                for call in tool_calls
+            ],
+        })
+
+        for call, (content, call_trace) in zip(tool_calls, registry.run_calls(tool_calls)):
+            messages.append({"role": "tool", "tool_call_id": call.id, "content": content})
+            trace.append(call_trace)
+
+    response = _create(
+        client,
+        model=model,
+        messages=messages,
+        tools=registry.schemas(),
+        tool_choice="none",
+    )
+    return response.choices[0].message.content or "", trace
@@ -0,0 +1,71 @@
+import hashlib
+import os
+import tempfile
+from contextlib import contextmanager
+
+# streamlit keeps every upload in the server process as a BytesIO, so the
+# raw bytes are already one copy per open session. everything here works
+# on a memoryview of that buffer (no second copy), and pdfs are spooled to
+# a temp file so parsing, including the worker processes, reads from disk
+MAX_UPLOAD_MB = int(os.environ.get("LAB_MAX_UPLOAD_MB", "50"))
+MAX_PDF_PAGES = int(os.environ.get("LAB_MAX_PDF_PAGES", "2000"))
+# None = the system temp dir
+SPOOL_DIR = os.environ.get("LAB_SPOOL_DIR") or None
+
+
+class UploadTooLarge(ValueError):
+    """The upload is over MAX_UPLOAD_MB or MAX_PDF_PAGES."""
+
+
+@contextmanager
+def _view(uploaded_file):
+    # getbuffer() shares the BytesIO's memory; other file objects are read once
+    if hasattr(uploaded_file, "getbuffer"):
+        view = uploaded_file.getbuffer()
+    else:
+        view = memoryview(uploaded_file.read())
+    try:
+        _check_size(view.nbytes, getattr(uploaded_file, "name", "upload"))
+        yield view
+    finally:
+        # the BytesIO can't be resized or closed while a view is exported
+        view.release()
+
+
+def _check_size(nbytes, name):
+    if nbytes > MAX_UPLOAD_MB * 1024 * 1024:
+        raise UploadTooLarge(
+            f"{name} is {nbytes / (1024 * 1024):.0f} MB, the limit is {MAX_UPLOAD_MB} MB."
+        )
+
+
+def check_page_count(page_count, max_pages=MAX_PDF_PAGES):
+    if max_pages and page_count > max_pages:
+        raise UploadTooLarge(f"The PDF has {page_count} pages, the limit is {max_pages}.")
+
+
+def upload_digest(uploaded_file) -> str:
+    """sha256 hex of the upload, after checking it against MAX_UPLOAD_MB."""
+    with _view(uploaded_file) as view:
+        return hashlib.sha256(view).hexdigest()
+
+
+@contextmanager
+def spool_upload(uploaded_file, suffix=""):
+    """Copy the upload to a temp file and yield its path; removed on exit."""
+    fd, path = tempfile.mkstemp(suffix=suffix, dir=SPOOL_DIR)
+    try:
+        with os.fdopen(fd, "wb") as f, _view(uploaded_file) as view:
+            f.write(view)
+        yield path
+    finally:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def read_text(uploaded_file, encoding="utf-8-sig") -> str:
+    """Decode a text upload straight from its buffer (bad bytes are replaced)."""
+    with _view(uploaded_file) as view:
+        return str(view, encoding, "replace")
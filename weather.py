@@ -0,0 +1,220 @@
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from caching import LRUCache
+from metrics import timed
+
+# lab 5 - OpenWeatherMap client
+# one pooled session per api key, current weather cached per normalized
+# location: fresh for WEATHER_TTL_SECONDS, then served stale for up to
+# WEATHER_STALE_SECONDS more while it's refreshed in the background
+WEATHER_BASE_URL = os.environ.get("OPENWEATHER_BASE_URL", "https://api.openweathermap.org")
+WEATHER_TIMEOUT_SECONDS = 20
+WEATHER_TTL_SECONDS = 600
+WEATHER_STALE_SECONDS = 3600
+WEATHER_CACHE_ENTRIES = 2048
+WEATHER_POOL_SIZE = 16
+# free tier quota, requests beyond it wait for the token bucket
+WEATHER_RATE_LIMIT_PER_MINUTE = 60
+
+_refresh_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix="weather-refresh")
+
+
+def normalize_location(location):
+    # "  syracuse ,NY, us " and "Syracuse, NY, US" share a cache entry
+    parts = (" ".join(part.split()) for part in location.lower().split(","))
+    return ",".join(part for part in parts if part)
+
+
+class RateLimiter:
+    """Token bucket: `rate` requests per `per` seconds, bursts up to `burst`."""
+
+    def __init__(self, rate, per=1.0, burst=None):
+        self.rate = rate / per
+        self.capacity = burst or rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class WeatherClient:
+    def __init__(
+        self,
+        api_key,
+        base_url=WEATHER_BASE_URL,
+        ttl=WEATHER_TTL_SECONDS,
+        stale_ttl=WEATHER_STALE_SECONDS,
+        timeout=WEATHER_TIMEOUT_SECONDS,
+        rate_limit_per_minute=WEATHER_RATE_LIMIT_PER_MINUTE,
+    ):
+        self.api_key = api_key
+        self.base_url = base_url.rstrip("/")
+        self.ttl = ttl
+        self.timeout = timeout
+
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        # keep-alive connections reused across requests and threads
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=WEATHER_POOL_SIZE)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        # only real requests take a token, cache hits are free
+        self.rate_limiter = RateLimiter(rate_limit_per_minute, per=60)
+
+        # values are (weather, fetched_at); the lru drops them once even
+        # stale data is too old to serve
+        self._cache = LRUCache(WEATHER_CACHE_ENTRIES, sizeof=lambda value: 1, ttl=ttl + stale_ttl)
+        self._inflight = {}
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.fetches = 0
+        self.errors = 0
+        self.fetch_seconds = 0.0
+        self.last_fetch_seconds = None
+
+    def _request(self, location, units):
+        self.rate_limiter.acquire()
+        started = time.perf_counter()
+        try:
+            response = self.session.get(
+                f"{self.base_url}/data/2.5/weather",
+                params={"q": location, "appid": self.api_key, "units": units},
+                timeout=self.timeout,
+            )
+        finally:
+            elapsed = time.perf_counter() - started
+            with self._lock:
+                self.fetches += 1
+                self.fetch_seconds += elapsed
+                self.last_fetch_seconds = elapsed
+
+        if response.status_code == 401:
+            raise Exception("Authentication failed: Invalid API key (401 Unauthorized)")
+        if response.status_code == 404:
+            error_message = response.json().get("message")
+            raise Exception(f"404 error: {error_message}")
+        response.raise_for_status()
+
+        data = response.json()
+        return {
+            "location": location,
+            "temperature": round(data["main"]["temp"], 2),
+            "feels_like": round(data["main"]["feels_like"], 2),
+            "temp_min": round(data["main"]["temp_min"], 2),
+            "temp_max": round(data["main"]["temp_max"], 2),
+            "humidity": round(data["main"]["humidity"], 2),
+            "description": data["weather"][0]["description"],
+        }
+
+    def _fetch(self, key, location, units):
+        # concurrent lookups of the same location share one request
+        with self._lock:
+            future = self._inflight.get(key)
+            leader = future is None
+            if leader:
+                future = self._inflight[key] = Future()
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            return future.result()
+
+        try:
+            weather = self._request(location, units)
+        except Exception as e:
+            with self._lock:
+                self.errors += 1
+            future.set_exception(e)
+            raise
+        else:
+            self._cache.put(key, (weather, time.monotonic()))
+            future.set_result(weather)
+            return weather
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+
+    def _refresh(self, key, location, units):
+        try:
+            self._fetch(key, location, units)
+        except Exception:
+            # keep serving the stale value, the next lookup retries
+            pass
+
+    def get(self, location, units="imperial"):
+        """Current weather for location, from the cache when possible."""
+        key = (normalize_location(location), units)
+        with timed("weather") as fields:
+            entry = self._cache.get(key)
+
+            if entry is not None:
+                weather, fetched_at = entry
+                if time.monotonic() - fetched_at < self.ttl:
+                    fields["cache"] = "hit"
+                    with self._lock:
+                        self.hits += 1
+                else:
+                    fields["cache"] = "stale"
+                    with self._lock:
+                        self.stale_hits += 1
+                        refreshing = key in self._inflight
+                    if not refreshing:
+                        _refresh_pool.submit(self._refresh, key, location, units)
+            else:
+                fields["cache"] = "miss"
+                with self._lock:
+                    self.misses += 1
+                weather = self._fetch(key, location, units)
+
+        # callers get their own copy, with the location as they spelled it
+        return dict(weather, location=location)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.stale_hits + self.misses
+            return {
+                "hits": self.hits,
+                "stale_hits": self.stale_hits,
+                "misses": self.misses,
+                "coalesced": self.coalesced,
+                "hit_rate": (self.hits + self.stale_hits) / lookups if lookups else 0.0,
+                "fetches": self.fetches,
+                "errors": self.errors,
+                "avg_fetch_ms": 1000 * self.fetch_seconds / self.fetches if self.fetches else 0.0,
+                "last_fetch_ms": 1000 * self.last_fetch_seconds if self.last_fetch_seconds is not None else None,
+                "entries": len(self._cache),
+            }
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_weather_client(api_key, base_url=WEATHER_BASE_URL):
+    """Process-wide client per (api key, base url), shared across reruns."""
+    key = (api_key, base_url)
+    with _clients_lock:
+        client = _clients.get(key)
+        if client is None:
+            client = _clients[key] = WeatherClient(api_key, base_url=base_url)
+        return client